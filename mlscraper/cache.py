@@ -0,0 +1,104 @@
+"""
+Caching of parsed pages, in memory and optionally on disk.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+from mlscraper.html import Backend
+from mlscraper.html import TreeIndex
+from mlscraper.html import ValueIndex
+
+# bump whenever the pickled indexes change
+CACHE_FORMAT_VERSION = 1
+
+
+class PageCache:
+    """
+    Reuses parsed trees and indexes of pages with identical html.
+
+    Pages are identified by a hash of their content, so identical html is parsed once
+    per process. If a directory is given, indexes are also stored on disk and loaded
+    instead of being built again, e.g. when training repeatedly on the same corpus.
+    The tree itself is parsed again on load as re-parsing is about as fast
+    as unpickling it.
+
+    >>> cache = PageCache(".mlscraper-cache")
+    >>> page = Page(html, cache=cache)
+    """
+
+    def __init__(self, directory=None, max_size=128):
+        """
+        :param directory: directory to store indexes in, None to cache in memory only
+        :param max_size: number of parsed pages to keep in memory
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get_indexes(self, html, backend: Backend) -> tuple[TreeIndex, tuple]:
+        """
+        Get the tree index and the value positions for html parsed with backend.
+        """
+        key = self._get_key(html, backend)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        entry = self._load(key, html, backend)
+        if entry is None:
+            tree = TreeIndex(backend.parse(html), backend)
+            entry = (tree, ValueIndex.index_values(tree, backend))
+            self._store(key, entry)
+
+        self._entries[key] = entry
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """
+        Clear the in-memory cache, files on disk are kept.
+        """
+        self._entries.clear()
+
+    @staticmethod
+    def _get_key(html, backend: Backend) -> str:
+        html_bytes = html.encode("utf-8") if isinstance(html, str) else html
+        content_hash = hashlib.sha256(html_bytes).hexdigest()
+        # different backends number the same html differently
+        return f"{type(backend).__name__}-{CACHE_FORMAT_VERSION}-{content_hash}"
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def _load(self, key: str, html, backend: Backend):
+        if self.directory is None or not os.path.exists(self._get_path(key)):
+            return None
+
+        try:
+            with open(self._get_path(key), "rb") as file:
+                tree, value_positions = pickle.load(file)
+            tree.attach(backend.parse(html), backend)
+        except Exception:
+            logging.warning("cannot load cached page, parsing again (key=%s)", key)
+            return None
+        return tree, value_positions
+
+    def _store(self, key: str, entry: tuple):
+        if self.directory is None:
+            return
+
+        tree, _ = entry
+        # computed now to be stored along with the rest
+        tree.text_lengths
+
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first, so others never read partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._get_path(key))
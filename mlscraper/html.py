@@ -1,26 +1,45 @@
 """
 Encapsulation of html-related functionality.
-BeautifulSoup should only get used here.
+BeautifulSoup and lxml should only get used here.
 """
-import html
+import bisect
+import functools
 import re
 import typing
 from abc import ABC
+from collections import Counter
+from collections import defaultdict
+from collections import OrderedDict
 from dataclasses import dataclass
 from functools import cached_property
 
+import lxml.html
+import soupsieve
 from bs4 import BeautifulSoup
+from bs4.builder import HTMLTreeBuilder
 from bs4.element import NavigableString
 from bs4.element import Tag
+from lxml import etree
+from mlscraper.util import AhoCorasickAutomaton
+
+if typing.TYPE_CHECKING:
+    from mlscraper.cache import PageCache
 
 
 # dots and slashes break bs4/soupsieve
 CLASS_CHAR_BLACKLIST = tuple(":/")
 
 
+# text of these tags is not part of the text of their ancestors
+NON_TEXT_TAGS = ("script", "style", "template")
+
+# number of rules a page keeps document-wide selections of, see Page
+SELECTION_CACHE_SIZE = 128
+
+
 class MlscraperTag(Tag):
     """
-    mlscraper's own BeautifulSoup Tag that caches hashes.
+    mlscraper's own BeautifulSoup Tag that is hashed by identity.
     """
 
     def __hash__(self):
@@ -30,16 +49,265 @@ class MlscraperTag(Tag):
         # which hashes the text contents of tags.
         # For our use case, this slows down many html-related functions
         # because set operations and equality checks rely on __hash__.
-        # To circumvent this, we lazily cache hashes
+        # It also makes tags with the same markup collide.
+        # Nodes are identified by their position in the document,
+        # so tags only need to be hashed by identity.
+        return id(self)
 
-        # warning: this assumes the soup to be static (which works for us)
+    def __eq__(self, other):
+        # bs4 compares markup, but equal markup can be found at different places
+        return self is other
 
-        if not self._hash:
-            # hash once and store
-            self._hash = str(self).__hash__()
+    def __ne__(self, other):
+        return self is not other
 
-        # return stored hash
-        return self._hash
+
+class Backend:
+    """
+    Parses html and provides access to the resulting element tree.
+
+    Nodes wrap the elements of their backend, Page and Node only talk to this API.
+    """
+
+    # select matches rules against the whole document, even from an element,
+    # so pages select once per rule and cut out the share of each element
+    selects_from_document = False
+
+    def parse(self, html):
+        """
+        Parse html and return the document, i.e. the element containing <html>.
+        """
+        raise NotImplementedError()
+
+    def get_children(self, element) -> list:
+        """
+        Get child elements in document order, text and comments excluded.
+        """
+        raise NotImplementedError()
+
+    def get_strings(self, element) -> list[str]:
+        """
+        Get the texts directly inside the element, not inside child elements.
+        """
+        raise NotImplementedError()
+
+    def get_text_strings(self, element) -> list[str]:
+        """
+        Get the strings directly inside the element that are part of its text.
+        """
+        raise NotImplementedError()
+
+    def get_text(self, element) -> str:
+        raise NotImplementedError()
+
+    def get_tag_name(self, element) -> str:
+        raise NotImplementedError()
+
+    def get_attributes(self, element) -> typing.Mapping:
+        raise NotImplementedError()
+
+    def get_classes(self, element) -> tuple[str]:
+        raise NotImplementedError()
+
+    def compile(self, css_rule: str):
+        """
+        Compile css_rule once to select with it repeatedly.
+
+        Raises ValueError if the backend does not support css_rule.
+        """
+        return css_rule
+
+    def select(self, element, css_rule, limit=None) -> list:
+        """
+        Get the descendants of element matched by css_rule in document order.
+
+        css_rule can be a str or the result of compile.
+        """
+        raise NotImplementedError()
+
+
+class SoupBackend(Backend):
+    """
+    BeautifulSoup with lxml as parser, the default backend.
+    """
+
+    def parse(self, html):
+        # use own Tag for hashing by identity
+        return BeautifulSoup(html, "lxml", element_classes={Tag: MlscraperTag})
+
+    def get_children(self, element) -> list:
+        return [c for c in element.children if isinstance(c, Tag)]
+
+    def get_strings(self, element) -> list[str]:
+        return [c for c in element.children if isinstance(c, NavigableString)]
+
+    def get_text_strings(self, element) -> list[str]:
+        # same as bs4's text, which e.g. skips comments
+        return [
+            c for c in element.children if type(c) in element.interesting_string_types
+        ]
+
+    def get_text(self, element) -> str:
+        return element.text
+
+    def get_tag_name(self, element) -> str:
+        return element.name
+
+    def get_attributes(self, element) -> typing.Mapping:
+        return element.attrs
+
+    def get_classes(self, element) -> tuple[str]:
+        return tuple(element.attrs.get("class", ()))
+
+    def compile(self, css_rule: str) -> soupsieve.SoupSieve:
+        try:
+            return soupsieve.compile(css_rule)
+        except soupsieve.SelectorSyntaxError as e:
+            raise ValueError(
+                f"css rule not supported by soupsieve ({css_rule=})"
+            ) from e
+
+    def select(self, element, css_rule, limit=None) -> list:
+        # bs4 takes compiled rules as well
+        return element.select(css_rule, limit=limit)
+
+
+class LxmlBackend(Backend):
+    """
+    Works on lxml's C-backed tree directly, which is a lot faster than BeautifulSoup.
+
+    Requires cssselect to translate css rules.
+    """
+
+    selects_from_document = True
+
+    def parse(self, html):
+        if isinstance(html, str):
+            # lxml refuses str with encoding declarations
+            html = html.encode("utf-8")
+
+        # lxml assumes latin-1 if no charset is declared, bs4 detects utf-8
+        try:
+            html.decode("utf-8")
+            parser = lxml.html.HTMLParser(encoding="utf-8")
+        except UnicodeDecodeError:
+            parser = lxml.html.HTMLParser()
+
+        try:
+            root = lxml.html.document_fromstring(html, parser=parser)
+        except etree.ParserError:
+            # empty document
+            root = lxml.html.document_fromstring(b"<html></html>", parser=parser)
+
+        # the tree acts as document, bs4 also has an element above <html>
+        return root.getroottree()
+
+    def get_children(self, element) -> list:
+        if _is_lxml_document(element):
+            return [element.getroot()]
+        return [c for c in element if isinstance(c.tag, str)]
+
+    def get_strings(self, element) -> list[str]:
+        if _is_lxml_document(element):
+            return []
+        strings = [element.text] if element.text else []
+        strings.extend(c.tail for c in element if c.tail)
+        return strings
+
+    def get_text_strings(self, element) -> list[str]:
+        # strings inside comments are the only ones not part of the text
+        return self.get_strings(element)
+
+    def get_text(self, element) -> str:
+        if _is_lxml_document(element):
+            element = element.getroot()
+
+        # like bs4, skip comments and scripts inside the element
+        strings = []
+        skipped_element = None
+        for event, e in etree.iterwalk(element, events=("start", "end")):
+            if skipped_element is not None:
+                # inside a subtree without text
+                if event == "end" and e is skipped_element:
+                    skipped_element = None
+                else:
+                    continue
+
+            if event == "start":
+                if e is not element and e.tag in NON_TEXT_TAGS:
+                    skipped_element = e
+                elif isinstance(e.tag, str) and e.text:
+                    strings.append(e.text)
+            elif e is not element and e.tail:
+                strings.append(e.tail)
+        return "".join(strings)
+
+    def get_tag_name(self, element) -> str:
+        if _is_lxml_document(element):
+            return "[document]"
+        return element.tag
+
+    def get_attributes(self, element) -> typing.Mapping:
+        if _is_lxml_document(element):
+            return {}
+
+        # split multi-valued attributes like bs4, so both backends find the same
+        multi_valued_attributes = _get_multi_valued_attributes(element.tag)
+        return {
+            attr: value.split() if attr in multi_valued_attributes else value
+            for attr, value in element.attrib.items()
+        }
+
+    def get_classes(self, element) -> tuple[str]:
+        if _is_lxml_document(element):
+            return ()
+        return tuple(element.get("class", "").split())
+
+    def compile(self, css_rule: str) -> etree.XPath:
+        return _compile_css_rule(css_rule)
+
+    def select(self, element, css_rule, limit=None) -> list:
+        if isinstance(css_rule, str):
+            css_rule = _compile_css_rule(css_rule)
+
+        # css matches relative to the whole document (like soupsieve),
+        # the element only restricts the results to its descendants
+        if _is_lxml_document(element):
+            return css_rule(element)[:limit]
+
+        results = css_rule(element.getroottree())
+        results = [r for r in results if _is_lxml_descendant(r, element)]
+        return results[:limit]
+
+
+@functools.lru_cache(None)
+def _get_multi_valued_attributes(tag_name: str) -> frozenset[str]:
+    list_attributes = HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+    return frozenset(list_attributes["*"]) | frozenset(
+        list_attributes.get(tag_name, ())
+    )
+
+
+def _is_lxml_document(element) -> bool:
+    return isinstance(element, etree._ElementTree)
+
+
+def _is_lxml_descendant(element, ancestor) -> bool:
+    return any(a is ancestor for a in element.iterancestors())
+
+
+@functools.lru_cache(1000)
+def _compile_css_rule(css_rule: str) -> etree.XPath:
+    # optional dependency, only needed for LxmlBackend
+    from cssselect import HTMLTranslator
+    from cssselect import SelectorError
+
+    # evaluated with <html> as context, which has to match as well
+    try:
+        xpath = HTMLTranslator().css_to_xpath(css_rule, prefix="descendant-or-self::")
+    except SelectorError as e:
+        raise ValueError(f"css rule not supported by cssselect ({css_rule=})") from e
+    return etree.XPath(xpath)
 
 
 @dataclass
@@ -57,26 +325,63 @@ class HTMLAttributeMatch(HTMLMatch):
     attr: str = None
 
 
+@dataclass
+class HTMLPartialTextMatch(HTMLMatch):
+    """
+    Text of the node contains the value, but also other text.
+    """
+
+
+@dataclass
+class HTMLPartialAttributeMatch(HTMLMatch):
+    """
+    Attribute of the node contains the value, but also other characters.
+    """
+
+    attr: str = None
+
+
 class Node:
-    soup = None
-    _page = None
+    """
+    Lightweight view of one element of a page.
+
+    All data lives in the page's arrays, nodes only know their position.
+    """
+
+    __slots__ = ("soup", "_page", "_position", "_hash")
 
     def __init__(self, soup, page: "Page"):
+        # soup is the element of the page's backend
         self.soup = soup
         self._page = page
+        self._position = page._tree.get_position(soup)
         self._hash = None
 
     @property
     def page(self):
         return self._page
 
-    @cached_property
+    @property
+    def position(self) -> int:
+        """
+        Position in document order, the page itself is 0.
+        """
+        return self._position
+
+    @property
+    def end_position(self) -> int:
+        """
+        Position of the last node in the subtree of this node.
+        """
+        return self._page._tree.exits[self._position]
+
+    @property
     def depth(self):
-        return self.parent.depth
+        return self._page._tree.depths[self._position]
 
-    @cached_property
+    @property
     def text(self):
-        return self.soup.text
+        return self._page.backend.get_text(self.soup)
 
     def find_all(self, item) -> list[HTMLMatch]:
         return list(self._generate_find_all(item))
@@ -84,99 +389,103 @@ class Node:
     def _generate_find_all(self, item):
         assert isinstance(item, str), "can only search for str at the moment"
 
-        # text
-        # - since text matches including whitespace, a regex is used
-        target_regex = re.compile(r"^\s*%s\s*$" % html.escape(item))
-        for soup_node in self.soup.find_all(string=target_regex):
-            # use parent node as found text is NaviableString and not Tag
-            node = self._page._get_node_for_soup(soup_node.parent)
-            yield HTMLExactTextMatch(node)
-
-            for p in node.ancestors:
-                if p.text.strip() == node.text.strip() and not isinstance(p, Page):
-                    yield HTMLExactTextMatch(p)
-
-        # attributes
-        for soup_node in self.soup.find_all():
-            for attr in soup_node.attrs:
-                if soup_node[attr] == item:
-                    node = self._page._get_node_for_soup(soup_node)
-                    yield HTMLAttributeMatch(node, attr)
-
-        # todo implement other find methods
+        # the page index covers the whole document,
+        # so only keep matches inside this node
+        for html_match in self._page._value_index.find_all(item):
+            if html_match.node == self or html_match.node.has_ancestor(self):
+                yield html_match
 
     def has_ancestor(self, node: "Node") -> bool:
         # early return if different page
         if self._page != node._page:
             return False
 
-        # inline to avoid creating ancestors
-        for a in self.soup.parents:
-            if a == node.soup:
-                return True
-        return False
+        return self._page._tree.is_ancestor(node._position, self._position)
 
-    @cached_property
+    @property
     def parent(self):
         """
         Get parent node.
         """
-        # don't return parent if it would be above <html> tag
-        if self.tag_name in ["html", "[document]"]:
-            return self._page
-
-        return self._page._get_node_for_soup(self.soup.parent)
+        # <html> returns the page as it is the document
+        return self._page._get_node_for_position(
+            self._page._tree.parents[self._position]
+        )
 
-    @cached_property
+    @property
     def ancestors(self) -> list["Node"]:
         """
         Return all ancestors starting with the parent.
         """
-        if self.parent:
-            return [self.parent] + self.parent.ancestors
-        else:
-            return []
+        # computed on demand, storing them per node takes O(n * depth) memory
+        return [
+            self._page._get_node_for_position(position)
+            for position in self._page._tree.iter_ancestor_positions(self._position)
+        ]
 
-    @cached_property
+    @property
     def classes(self) -> tuple[str]:
-        return tuple(filter(is_supported_class, self.soup.attrs.get("class", ())))
+        return self._page._tree.get_classes(self._position)
 
     @property
     def id(self):
-        return self.soup.attrs.get("id", None)
+        return self.html_attributes.get("id", None)
 
     @property
     def tag_name(self):
-        return self.soup.name
+        tree = self._page._tree
+        return tree.tag_names[tree.tag_ids[self._position]]
+
+    @property
+    def child_index(self) -> int:
+        """
+        1-based index among the sibling elements, as used by :nth-child.
+        """
+        return self._page._tree.child_indices[self._position]
+
+    @property
+    def type_index(self) -> int:
+        """
+        1-based index among the siblings with the same tag, as used by :nth-of-type.
+        """
+        return self._page._tree.type_indices[self._position]
 
     @property
     def html_attributes(self):
-        return self.soup.attrs
+        return self._page.backend.get_attributes(self.soup)
 
     def select(self, css_selector, limit=None):
+        if self._page.backend.selects_from_document:
+            return [
+                self._page._get_node_for_position(position)
+                for position in self._page._select_positions(
+                    css_selector, self._position, limit
+                )
+            ]
+
         return [
             self._page._get_node_for_soup(n)
-            for n in self.soup.select(css_selector, limit=limit)
+            for n in self._page.backend.select(self.soup, css_selector, limit=limit)
         ]
 
     def __repr__(self):
-        if isinstance(self.soup, NavigableString):
-            return f"<{self.__class__.__name__} {self.soup.strip()[:10]=}>"
         return (
-            f"<{self.__class__.__name__} {self.soup.name=}"
-            f" classes={self.soup.get('class', None)},"
-            f" text={''.join(self.soup.stripped_strings)[:10]}...>"
+            f"<{self.__class__.__name__} {self.tag_name=}"
+            f" classes={self.classes},"
+            f" text={''.join(self.text.split())[:10]}...>"
         )
 
     def __hash__(self):
-        if not self._hash:
-            self._hash = self.soup.__hash__()
+        if self._hash is None:
+            self._hash = hash((self._page, self._position))
         return self._hash
-        # return self.soup.__hash__()
-        # return super().__hash__()
 
     def __eq__(self, other):
-        return isinstance(other, Node) and self.soup == other.soup
+        return (
+            isinstance(other, Node)
+            and self._position == other._position
+            and self._page == other._page
+        )
 
 
 class Page(Node):
@@ -184,16 +493,34 @@ class Page(Node):
     One page, i.e. one HTML document.
     """
 
-    _node_registry = None
-
-    def __init__(self, html):
+    def __init__(self, html, backend: Backend = None, cache: "PageCache" = None):
+        """
+        :param html: the html of the page
+        :param backend: the backend to parse html with, SoupBackend by default
+        :param cache: a PageCache to reuse parsed trees and indexes from
+        """
         self.html = html
+        self.backend = backend or SoupBackend()
 
-        # use own Tag for lazy hashing
-        soup = BeautifulSoup(self.html, "lxml", element_classes={Tag: MlscraperTag})
+        if cache is not None:
+            self._tree, self._value_positions = cache.get_indexes(
+                self.html, self.backend
+            )
+        else:
+            # number tags right after parsing, positions identify nodes from now on
+            self._tree = TreeIndex(self.backend.parse(self.html), self.backend)
+            self._value_positions = None
+        soup = self._tree.soups[0]
+
+        # register node for each position, created lazily
+        self._node_registry = [None] * len(self._tree.soups)
+        self._node_registry[0] = self
 
-        # register node for each soup
-        self._node_registry = {soup: self}
+        # value matches of this page, see mlscraper.matches.get_value_match_store
+        self._value_match_store = None
+
+        # positions selected on the whole document by rule, see _select_positions
+        self._positions_by_rule = OrderedDict()
 
         super().__init__(soup, self)
 
@@ -201,41 +528,795 @@ class Page(Node):
     def depth(self):
         return 0
 
+    def get_node_at(self, position: int) -> Node:
+        """
+        Get the node at position, e.g. to find a node on a copy of the page.
+        """
+        return self._get_node_for_position(position)
+
+    def _select_positions(self, css_rule, position: int, limit=None) -> list[int]:
+        # rules are run once on the document and cached,
+        # the descendants of position are a contiguous slice of the results
+        if isinstance(css_rule, str):
+            css_rule = self.backend.compile(css_rule)
+        if css_rule in self._positions_by_rule:
+            self._positions_by_rule.move_to_end(css_rule)
+        else:
+            self._positions_by_rule[css_rule] = [
+                self._tree.get_position(element)
+                for element in self.backend.select(self._tree.soups[0], css_rule)
+            ]
+            if len(self._positions_by_rule) > SELECTION_CACHE_SIZE:
+                self._positions_by_rule.popitem(last=False)
+        positions = self._positions_by_rule[css_rule]
+
+        start = bisect.bisect_right(positions, position)
+        end = bisect.bisect_right(positions, self._tree.exits[position])
+        if limit is not None:
+            end = min(end, start + limit)
+        return positions[start:end]
+
     def _get_node_for_soup(self, soup) -> Node:
-        if soup not in self._node_registry:
-            self._node_registry[soup] = Node(soup, self)
-        return self._node_registry[soup]
+        return self._get_node_for_position(self._tree.get_position(soup))
+
+    def _get_node_for_position(self, position: int) -> Node:
+        node = self._node_registry[position]
+        if node is None:
+            node = Node(self._tree.soups[position], self)
+            self._node_registry[position] = node
+        return node
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self.html)
+        return self._hash
+
+    def __eq__(self, other):
+        # pages with the same html are equal, so are their nodes
+        return self is other or (isinstance(other, Page) and self.html == other.html)
 
     @property
     def parent(self):
         return None
 
+    @cached_property
+    def _value_index(self) -> "ValueIndex":
+        # built lazily on first lookup, afterwards searching is a dict lookup
+        return ValueIndex(self, self._value_positions)
+
+    def find_all(self, item) -> list[HTMLMatch]:
+        assert isinstance(item, str), "can only search for str at the moment"
+        return self._value_index.find_all(item)
+
+    def find_all_many(
+        self, items, substring=False, normalize_whitespace=False
+    ) -> dict[str, list[HTMLMatch]]:
+        """
+        Find all given items at once.
+
+        :param items: the str values to search for
+        :param substring: also find values contained in longer texts or attributes
+        :param normalize_whitespace: treat all runs of whitespace as one space
+        """
+        assert all(
+            isinstance(item, str) for item in items
+        ), "can only search for str at the moment"
+        return self._value_index.find_all_many(items, substring, normalize_whitespace)
+
+
+class ValueIndex:
+    """
+    Inverted index that maps values to the places they occur at on a page.
+
+    Text is indexed whitespace-stripped, attribute values are indexed as-is.
+    """
+
+    def __init__(self, page: Page, positions_by_value: tuple[dict, dict] = None):
+        """
+        :param page: the page to index
+        :param positions_by_value: result of index_values to reuse, e.g. from a cache
+        """
+        self._page = page
+
+        # positions are stored instead of nodes to create nodes only for hits
+        if positions_by_value is None:
+            positions_by_value = self.index_values(page._tree, page.backend)
+        (
+            self._text_positions_by_value,
+            self._attribute_positions_by_value,
+        ) = positions_by_value
+        self._matches_by_value = {}
+
+    @staticmethod
+    def index_values(tree: "TreeIndex", backend: Backend) -> tuple[dict, dict]:
+        """
+        Map texts to positions and attribute values to positions and attributes.
+        """
+        text_positions_by_value = defaultdict(list)
+        attribute_positions_by_value = defaultdict(list)
+        for position, soup_node in enumerate(tree.soups):
+            # texts belong to the element that directly contains them
+            for string in backend.get_strings(soup_node):
+                text_positions_by_value[string.strip()].append(position)
+
+            for attr, attr_value in backend.get_attributes(soup_node).items():
+                # multi-valued attributes like class are lists
+                if isinstance(attr_value, str):
+                    attribute_positions_by_value[attr_value].append((position, attr))
+
+        # plain dicts, lookups of missing values must not add them
+        return dict(text_positions_by_value), dict(attribute_positions_by_value)
+
+    def find_all(self, item: str) -> list[HTMLMatch]:
+        """
+        Find all exact text and attribute matches of item on the page.
+        """
+        if item not in self._matches_by_value:
+            self._matches_by_value[item] = list(self._generate_find_all(item))
+        return list(self._matches_by_value[item])
+
+    def _generate_find_all(self, item: str):
+        page = self._page
+
+        # text
+        # - text matches ignoring surrounding whitespace
+        for position in self._text_positions_by_value.get(item.strip(), ()):
+            yield from self._generate_text_matches(position, str.strip)
+
+        # attributes
+        for position, attr in self._attribute_positions_by_value.get(item, ()):
+            node = page._get_node_for_position(position)
+            yield HTMLAttributeMatch(node, attr)
+
+        # todo implement other find methods
+
+    def _generate_text_matches(self, position, normalize):
+        page = self._page
+        node = page._get_node_for_position(position)
+        yield HTMLExactTextMatch(node)
+
+        for ancestor_position in page._tree.iter_ancestor_positions(position):
+            ancestor = page._get_node_for_position(ancestor_position)
+            if isinstance(ancestor, Page):
+                continue
+
+            is_same_text = page._tree.has_same_text_as_ancestor(
+                position, ancestor_position
+            )
+            if is_same_text is None:
+                is_same_text = normalize(ancestor.text) == normalize(node.text)
+
+            if is_same_text:
+                yield HTMLExactTextMatch(ancestor)
+
+    def find_all_many(
+        self, items, substring=False, normalize_whitespace=False
+    ) -> dict[str, list[HTMLMatch]]:
+        """
+        Find all matches of several items with one pass over the indexed values.
+        """
+        items = list(dict.fromkeys(items))
+        if not substring and not normalize_whitespace:
+            # exact matches are plain lookups
+            return {item: self.find_all(item) for item in items}
+
+        if normalize_whitespace:
+            normalize_text = normalize_attribute = collapse_whitespace
+        else:
+            normalize_text, normalize_attribute = str.strip, str
+
+        items_by_pattern = defaultdict(list)
+        for item in items:
+            items_by_pattern[normalize_text(item)].append(item)
+
+        if substring:
+            automaton = AhoCorasickAutomaton(items_by_pattern)
+
+            def find_patterns(value):
+                return automaton.find_patterns(value)
+
+        else:
+
+            def find_patterns(value):
+                return {value} if value in items_by_pattern else ()
+
+        html_matches_by_item = {item: [] for item in items}
+
+        def add(pattern, html_matches):
+            html_matches = list(html_matches)
+            for item in items_by_pattern[pattern]:
+                html_matches_by_item[item].extend(html_matches)
+
+        page = self._page
+        for value, positions in self._text_positions_by_value.items():
+            value = normalize_text(value)
+            for pattern in find_patterns(value):
+                for position in positions:
+                    if pattern == value:
+                        add(
+                            pattern,
+                            self._generate_text_matches(position, normalize_text),
+                        )
+                    else:
+                        node = page._get_node_for_position(position)
+                        add(pattern, [HTMLPartialTextMatch(node)])
+
+        for value, positions_and_attrs in self._attribute_positions_by_value.items():
+            value = normalize_attribute(value)
+            for pattern in find_patterns(value):
+                for position, attr in positions_and_attrs:
+                    node = page._get_node_for_position(position)
+                    if pattern == value:
+                        add(pattern, [HTMLAttributeMatch(node, attr)])
+                    else:
+                        add(pattern, [HTMLPartialAttributeMatch(node, attr)])
+
+        return html_matches_by_item
+
+
+class TreeIndex:
+    """
+    Numbers all tags of a page in document order (pre-order).
+
+    A subtree then spans the positions from its root to its exit position,
+    so ancestor checks become two comparisons.
+    """
+
+    def __init__(self, soup, backend: Backend):
+        self._backend = backend
+
+        # all arrays are indexed by position, the document itself is 0
+        self.soups = []
+        self.parents = []
+        self.depths = []
+        self.exits = []
+
+        # tag names and class combinations are interned and stored as ids
+        self.tag_names = []
+        self.tag_ids = []
+        self.class_names = []
+        self.class_ids = []
+        self._tag_ids_by_name = {}
+        self._class_ids_by_name = {}
+        self._interned_class_ids = {}
+        self._classes_by_class_ids = {}
+
+        # elements are keyed by id to avoid hashing them
+        self._positions_by_soup_id = {}
+
+        for position, (soup_node, parent_position) in enumerate(
+            self._walk(soup, backend)
+        ):
+            self._positions_by_soup_id[id(soup_node)] = position
+            self.soups.append(soup_node)
+            self.parents.append(parent_position)
+            self.depths.append(
+                self.depths[parent_position] + 1 if parent_position >= 0 else 0
+            )
+            self.exits.append(position)
+            self.tag_ids.append(self._intern_tag(backend.get_tag_name(soup_node)))
+            self.class_ids.append(
+                self._intern_classes(
+                    filter(is_supported_class, backend.get_classes(soup_node))
+                )
+            )
+
+        # positions of a subtree are contiguous, so update exits bottom-up
+        for position in range(len(self.soups) - 1, 0, -1):
+            parent_position = self.parents[position]
+            self.exits[parent_position] = max(
+                self.exits[parent_position], self.exits[position]
+            )
+
+    @staticmethod
+    def _walk(soup, backend: Backend):
+        # yields elements in pre-order along with the position of their parent
+        stack = [(soup, -1)]
+        position = 0
+        while stack:
+            soup_node, parent_position = stack.pop()
+            yield soup_node, parent_position
+
+            # reversed to pop children in document order
+            children = backend.get_children(soup_node)
+            stack.extend((c, position) for c in reversed(children))
+            position += 1
+
+    def __getstate__(self):
+        # elements belong to one parsed document, see attach,
+        # the lowest common ancestor tables are cheaper to rebuild than to load
+        state = self.__dict__.copy()
+        for key in (
+            "_backend",
+            "soups",
+            "_positions_by_soup_id",
+            "_euler_tour",
+            "_sparse_table",
+        ):
+            state.pop(key, None)
+        return state
+
+    def attach(self, soup, backend: Backend):
+        """
+        Set the elements of an unpickled index.
+
+        soup has to be parsed from the same html with the same kind of backend,
+        as the elements are numbered again in the same order.
+        """
+        self._backend = backend
+        self.soups = []
+        self._positions_by_soup_id = {}
+        for position, (soup_node, _) in enumerate(self._walk(soup, backend)):
+            self._positions_by_soup_id[id(soup_node)] = position
+            self.soups.append(soup_node)
+        assert len(self.soups) == len(self.parents), "index of another document"
+
+    def _intern_tag(self, tag_name: str) -> int:
+        if tag_name not in self._tag_ids_by_name:
+            self._tag_ids_by_name[tag_name] = len(self.tag_names)
+            self.tag_names.append(tag_name)
+        return self._tag_ids_by_name[tag_name]
+
+    def _intern_classes(self, classes: typing.Iterable[str]) -> tuple[int]:
+        class_ids = []
+        for cl in classes:
+            if cl not in self._class_ids_by_name:
+                self._class_ids_by_name[cl] = len(self.class_names)
+                self.class_names.append(cl)
+            class_ids.append(self._class_ids_by_name[cl])
+
+        # equal combinations share one tuple
+        class_ids = tuple(class_ids)
+        if class_ids not in self._interned_class_ids:
+            self._interned_class_ids[class_ids] = class_ids
+            self._classes_by_class_ids[class_ids] = tuple(
+                self.class_names[i] for i in class_ids
+            )
+        return self._interned_class_ids[class_ids]
+
+    def get_classes(self, position: int) -> tuple[str]:
+        return self._classes_by_class_ids[self.class_ids[position]]
+
+    @cached_property
+    def text_lengths(self) -> list[int]:
+        """
+        Number of non-whitespace characters in the text of each position.
+
+        Computed bottom-up, so no text has to be built.
+        """
+        lengths = [
+            sum(len("".join(s.split())) for s in self._backend.get_text_strings(soup))
+            for soup in self.soups
+        ]
+        for position in range(len(self.soups) - 1, 0, -1):
+            if not self._is_text_barrier(position):
+                lengths[self.parents[position]] += lengths[position]
+        return lengths
+
+    def _is_text_barrier(self, position: int) -> bool:
+        return self.tag_names[self.tag_ids[position]] in NON_TEXT_TAGS
+
+    @cached_property
+    def _text_barriers(self) -> list[int]:
+        # closest position at or above each position whose text is not inherited
+        barriers = []
+        for position, parent_position in enumerate(self.parents):
+            if self._is_text_barrier(position):
+                barriers.append(position)
+            elif parent_position >= 0:
+                barriers.append(barriers[parent_position])
+            else:
+                barriers.append(-1)
+        return barriers
+
+    def has_same_text_as_ancestor(
+        self, position: int, ancestor_position: int
+    ) -> typing.Optional[bool]:
+        """
+        Check if the stripped texts of position and its ancestor are equal.
+
+        Returns None if this cannot be decided from text lengths,
+        which happens for texts inside scripts, styles, and templates.
+        """
+        barrier = self._text_barriers[position]
+        if barrier >= 0 and (
+            barrier == ancestor_position or self.is_ancestor(ancestor_position, barrier)
+        ):
+            return None
+
+        # the text of position is a contiguous part of the ancestor's text,
+        # so they are equal if the ancestor adds whitespace only
+        return self.text_lengths[position] == self.text_lengths[ancestor_position]
+
+    @cached_property
+    def child_indices(self) -> list[int]:
+        """
+        1-based index of each position among its element siblings, like :nth-child.
+        """
+        indices = [1] * len(self.parents)
+        child_counts = [0] * len(self.parents)
+        # siblings are numbered in document order, as positions are pre-order
+        for position, parent_position in enumerate(self.parents):
+            if parent_position >= 0:
+                child_counts[parent_position] += 1
+                indices[position] = child_counts[parent_position]
+        return indices
+
+    @cached_property
+    def type_indices(self) -> list[int]:
+        """
+        1-based index of each position among its siblings with the same tag,
+        like :nth-of-type.
+        """
+        indices = [1] * len(self.parents)
+        type_counts = Counter()
+        for position, parent_position in enumerate(self.parents):
+            if parent_position >= 0:
+                key = (parent_position, self.tag_ids[position])
+                type_counts[key] += 1
+                indices[position] = type_counts[key]
+        return indices
+
+    def iter_ancestor_positions(self, position: int):
+        """
+        Yield the positions of all ancestors starting with the parent.
+        """
+        position = self.parents[position]
+        while position >= 0:
+            yield position
+            position = self.parents[position]
+
+    def get_position(self, soup) -> int:
+        return self._positions_by_soup_id[id(soup)]
+
+    def is_ancestor(self, ancestor_position: int, position: int) -> bool:
+        """
+        Check if ancestor_position is a proper ancestor of position.
+        """
+        return ancestor_position < position <= self.exits[ancestor_position]
+
+    @cached_property
+    def _euler_tour(self):
+        children = [[] for _ in self.soups]
+        for position, parent_position in enumerate(self.parents):
+            if parent_position >= 0:
+                children[parent_position].append(position)
+
+        # tour visits a node before and after each child
+        tour = [0]
+        first_visits = [0] * len(self.soups)
+        stack = [iter(children[0])]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                if stack:
+                    tour.append(self.parents[tour[-1]])
+            else:
+                first_visits[child] = len(tour)
+                tour.append(child)
+                stack.append(iter(children[child]))
+        return tour, first_visits
+
+    @cached_property
+    def _sparse_table(self) -> list[list[int]]:
+        # the lowest common ancestor is the node with the lowest position
+        # on the tour between both nodes, as ancestors precede descendants
+        tour, _ = self._euler_tour
+        table = [tour]
+        width = 1
+        while 2 * width <= len(tour):
+            previous = table[-1]
+            table.append(
+                [
+                    min(previous[i], previous[i + width])
+                    for i in range(len(tour) - 2 * width + 1)
+                ]
+            )
+            width *= 2
+        return table
+
+    def get_lowest_common_ancestor(self, position1: int, position2: int) -> int:
+        """
+        Get the deepest position that contains both positions (or is one of them).
+        """
+        if position1 == position2 or self.is_ancestor(position1, position2):
+            return position1
+        if self.is_ancestor(position2, position1):
+            return position2
+
+        _, first_visits = self._euler_tour
+        start, end = sorted((first_visits[position1], first_visits[position2]))
+        level = (end - start + 1).bit_length() - 1
+        row = self._sparse_table[level]
+        return min(row[start], row[end - (1 << level) + 1])
+
+
+_CSS_IDENTIFIER = r"-?[_a-zA-Z][_a-zA-Z0-9-]*"
+
+# the parts of the rules that selector generation creates, see SelectorIndex
+_SIMPLE_SELECTOR_PATTERN = re.compile(
+    rf"""
+    (?P<tag>{_CSS_IDENTIFIER})
+    |\#(?P<id>{_CSS_IDENTIFIER})
+    |\.(?P<class>{_CSS_IDENTIFIER})
+    |\[(?P<attribute>{_CSS_IDENTIFIER})(?:="(?P<value>[^"\\\r\n\f]*)")?\]
+    |:nth-child\((?P<nth_child>[1-9][0-9]*)\)
+    |:nth-of-type\((?P<nth_of_type>[1-9][0-9]*)\)
+    |(?P<combinator>[ ]>[ ]|[ ])
+    """,
+    re.VERBOSE,
+)
+
+
+class SelectorIndex:
+    """
+    Evaluates simple css rules on a page with bitsets of positions.
+
+    Handles the rules selector generation creates, i.e. compounds of tags, ids,
+    classes, attributes, :nth-child, and :nth-of-type
+    joined by descendant or child combinators.
+    Sets of positions are ints with bit i set for position i, so a compound is
+    an intersection of sets and combinators use the tree intervals.
+    Atoms are indexed as sorted position lists, their sets are created
+    when a rule uses them, as most atoms like unique hrefs are never selected.
+    """
+
+    def __init__(self, page: Page):
+        tree = page._tree
+        backend = page.backend
+        self._tree = tree
+
+        positions_by_atom = defaultdict(list)
+        # the document itself is never selected
+        for position in range(1, len(tree.soups)):
+            soup_node = tree.soups[position]
+            positions_by_atom[("tag", backend.get_tag_name(soup_node))].append(position)
+            positions_by_atom[("nth_child", tree.child_indices[position])].append(
+                position
+            )
+            positions_by_atom[("nth_of_type", tree.type_indices[position])].append(
+                position
+            )
+            # classes unfiltered, rules can select any of them
+            for cl in backend.get_classes(soup_node):
+                positions_by_atom[("class", cl)].append(position)
+            for attr, attr_value in backend.get_attributes(soup_node).items():
+                positions_by_atom[("attribute", attr)].append(position)
+                if not isinstance(attr_value, str):
+                    # multi-valued attributes are matched space-separated
+                    attr_value = " ".join(attr_value)
+                positions_by_atom[("value", attr, attr_value)].append(position)
+                if attr == "id":
+                    positions_by_atom[("id", attr_value)].append(position)
+
+        self._positions_by_atom = dict(positions_by_atom)
+        # filled on demand, see _get_atom_bits
+        self._bits_by_atom = {}
+
+    def get_frequency(self, atom: tuple) -> int:
+        """
+        Number of nodes matching atom, e.g. ("class", "a").
+        """
+        return len(self._positions_by_atom.get(atom, ()))
+
+    def _get_atom_bits(self, atom: tuple) -> int:
+        if atom not in self._bits_by_atom:
+            self._bits_by_atom[atom] = self.get_bits(
+                self._positions_by_atom.get(atom, ())
+            )
+        return self._bits_by_atom[atom]
+
+    @staticmethod
+    def get_bits(positions: typing.Iterable[int]) -> int:
+        """
+        Get the set of the given positions.
+        """
+        positions = list(positions)
+        if not positions:
+            return 0
+
+        # setting bytes is linear, unlike shifting and or-ing big ints repeatedly
+        array = bytearray(max(positions) // 8 + 1)
+        for position in positions:
+            array[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(array, "little")
+
+    @staticmethod
+    def iter_positions(bits: int) -> typing.Generator[int, None, None]:
+        """
+        Yield the positions of a set in ascending order.
+        """
+        binary = bin(bits)[:1:-1]
+        position = binary.find("1")
+        while position >= 0:
+            yield position
+            position = binary.find("1", position + 1)
+
+    def selects_exactly(
+        self, positions: list[int], nodes_per_root: dict[Node, typing.Sequence[Node]]
+    ) -> bool:
+        """
+        Check if selecting positions from each root returns exactly its nodes.
+
+        positions are all selected positions of the page in document order,
+        each root's share is cut out with its interval.
+        """
+        for root, nodes in nodes_per_root.items():
+            start = bisect.bisect_right(positions, root._position)
+            end = bisect.bisect_right(positions, self._tree.exits[root._position])
+            # selections are in document order, so the order of nodes has to match
+            if positions[start:end] != [n._position for n in nodes]:
+                return False
+        return True
+
+    @staticmethod
+    def count(bits: int) -> int:
+        return bin(bits).count("1")
+
+    def get_subtree_bits(self, position: int) -> int:
+        """
+        Get the set of all positions below position, i.e. its descendants.
+        """
+        exit_position = self._tree.exits[position]
+        return ((1 << (exit_position - position)) - 1) << (position + 1)
+
+    def select(self, css_rule: str) -> typing.Optional[int]:
+        """
+        Get the set of all positions css_rule matches on the page.
+
+        Returns None if css_rule is not supported, select with the backend then.
+        """
+        compounds = self._parse(css_rule)
+        if compounds is None:
+            return None
+
+        bits = None
+        for combinator, atoms in compounds:
+            compound_bits = self._get_compound_bits(atoms)
+            if combinator is None:
+                bits = compound_bits
+            elif combinator == ">":
+                bits = compound_bits & self._get_children_bits(bits, compound_bits)
+            else:
+                bits = compound_bits & self._get_descendants_bits(bits)
+        return bits
+
+    def get_count_bounds(self, css_rule: str) -> typing.Optional[tuple[int, int]]:
+        """
+        Lower and upper bound of the number of positions css_rule selects.
+
+        Estimated from the frequencies of its parts without selecting,
+        returns None if css_rule is not supported.
+        """
+        compounds = self._parse(css_rule)
+        if compounds is None:
+            return None
+
+        # everything selected matches the last compound, thus each of its atoms
+        _, atoms = compounds[-1]
+        upper = min(map(self.get_frequency, atoms))
+        is_single_atom = len(compounds) == 1 and len(atoms) == 1
+        return upper if is_single_atom else 0, upper
+
+    def _get_compound_bits(self, atoms: list[tuple]) -> int:
+        bits = self._get_atom_bits(atoms[0])
+        for atom in atoms[1:]:
+            bits &= self._get_atom_bits(atom)
+        return bits
+
+    def _get_descendants_bits(self, bits: int) -> int:
+        descendants_bits = 0
+        last_exit = -1
+        for position in self.iter_positions(bits):
+            # subtrees of descendants are part of the current subtree already
+            if position > last_exit:
+                descendants_bits |= self.get_subtree_bits(position)
+                last_exit = self._tree.exits[position]
+        return descendants_bits
+
+    def _get_children_bits(self, parent_bits: int, candidate_bits: int) -> int:
+        # check the parents of the candidates instead of collecting all children
+        parents = self._tree.parents
+        return self.get_bits(
+            position
+            for position in self.iter_positions(candidate_bits)
+            if parent_bits >> parents[position] & 1
+        )
+
+    @staticmethod
+    @functools.lru_cache(1000)
+    def _parse(css_rule: str) -> typing.Optional[tuple]:
+        # list of (combinator, atoms), None if the rule is not supported
+        compounds = []
+        combinator = None
+        atoms = []
+        index = 0
+        while index < len(css_rule):
+            match = _SIMPLE_SELECTOR_PATTERN.match(css_rule, index)
+            if not match:
+                return None
+            index = match.end()
+
+            if match["combinator"]:
+                if not atoms:
+                    return None
+                compounds.append((combinator, tuple(atoms)))
+                combinator = match["combinator"].strip() or " "
+                atoms = []
+            elif match["tag"]:
+                # tags start a compound, html tag names are case-insensitive
+                if atoms:
+                    return None
+                atoms.append(("tag", match["tag"].lower()))
+            elif match["id"]:
+                atoms.append(("id", match["id"]))
+            elif match["class"]:
+                atoms.append(("class", match["class"]))
+            elif match["attribute"]:
+                attr = match["attribute"].lower()
+                if match["value"] is None:
+                    atoms.append(("attribute", attr))
+                elif attr == "type":
+                    # compared case-insensitively by soupsieve only
+                    return None
+                else:
+                    atoms.append(("value", attr, match["value"]))
+            elif match["nth_child"]:
+                atoms.append(("nth_child", int(match["nth_child"])))
+            else:
+                atoms.append(("nth_of_type", int(match["nth_of_type"])))
+
+        if not atoms:
+            return None
+        compounds.append((combinator, tuple(atoms)))
+        return tuple(compounds)
+
+
+def parse_parallel_page(page: Page, backend: Backend) -> typing.Optional[Page]:
+    """
+    Parse the html of page with another backend.
+
+    Returns None if the trees differ, e.g. if the parsers repair broken html
+    differently, as positions have to refer to the same elements on both pages.
+    """
+    parallel_page = Page(page.html, backend)
+    tree = page._tree
+    parallel_tree = parallel_page._tree
+    if tree.parents != parallel_tree.parents or any(
+        tree.tag_names[tag_id] != parallel_tree.tag_names[parallel_tag_id]
+        for tag_id, parallel_tag_id in zip(tree.tag_ids[1:], parallel_tree.tag_ids[1:])
+    ):
+        return None
+    return parallel_page
+
 
 def get_root_node(nodes: list[Node]) -> Node:
     pages = [n._page for n in nodes]
     assert len(set(pages)) == 1, "different pages found, cannot get a root"
+    page = pages[0]
 
-    # generate parent paths from top to bottom
-    # [elem, parent, ancestor, root]
-    parent_paths = [reversed([n] + n.ancestors) for n in nodes]
-
-    # start looping from bottom to top
-    # zip automatically uses common length
-    # -> last element is the first one, where len(nodes) roots to compare exist
-    for layer_nodes in reversed(list(zip(*parent_paths))):
-        if len(set(layer_nodes)) == 1:
-            return layer_nodes[0]
-    raise RuntimeError("no root found")
+    root_position = nodes[0]._position
+    for node in nodes[1:]:
+        root_position = page._tree.get_lowest_common_ancestor(
+            root_position, node._position
+        )
+    return page._get_node_for_position(root_position)
 
 
 def get_relative_depth(node: Node, root: Node):
     """
     Return the relative depth of node inside tree starting from root.
     """
-    hierarchy = list(reversed([node] + node.ancestors))
-    assert node in hierarchy
-    assert root in hierarchy
-    return hierarchy.index(node) - hierarchy.index(root)
+    assert node == root or node.has_ancestor(root)
+    return node.depth - root.depth
+
+
+def collapse_whitespace(text: str) -> str:
+    """
+    Strip text and replace each run of whitespace, e.g. &nbsp; or newlines, by a space.
+    """
+    return " ".join(text.split())
 
 
 def make_selector_for_classes(class_combination: typing.Collection[str]):
@@ -250,22 +1331,58 @@ def is_supported_class(cl):
 
 
 def get_similarity(node1: Node, node2: Node, depth=3) -> float:
-    if depth < 1:
-        return 0
+    return NodeSimilarity()(node1, node2, depth)
 
-    if node1.tag_name != node2.tag_name:
-        return 0
 
-    # compute nodes jaccard similarity
-    jaccard_top = len(set(node1.classes).intersection(node2.classes))
-    jaccard_bottom = len(set(node1.classes).union(node2.classes))
-    if jaccard_top == jaccard_bottom:
-        return 1  # also 0/0
-    jaccard = jaccard_top / jaccard_bottom
-
-    # add recursion
-    if node1.parent and node2.parent:
-        jaccard = 0.8 * jaccard + 0.2 * get_similarity(
-            node1.parent, node2.parent, depth=depth - 1
-        )
-    return jaccard
+class NodeSimilarity:
+    """
+    Similarity of nodes based on tags and classes of them and their parents.
+
+    Results are memoized and classes are compared as bitsets,
+    so keep an instance around to compare many nodes repeatedly.
+    """
+
+    def __init__(self):
+        self._similarities = {}
+        self._bits_by_class = {}
+        self._class_bits_by_classes = {}
+
+    def __call__(self, node1: Node, node2: Node, depth=3) -> float:
+        key = (node1, node2, depth)
+        if key not in self._similarities:
+            self._similarities[key] = self._compute(node1, node2, depth)
+        return self._similarities[key]
+
+    def _get_class_bits(self, classes: tuple[str]) -> int:
+        # class tuples are interned per page, so this is mostly a lookup
+        if classes not in self._class_bits_by_classes:
+            bits = 0
+            for cl in classes:
+                if cl not in self._bits_by_class:
+                    self._bits_by_class[cl] = 1 << len(self._bits_by_class)
+                bits |= self._bits_by_class[cl]
+            self._class_bits_by_classes[classes] = bits
+        return self._class_bits_by_classes[classes]
+
+    def _compute(self, node1: Node, node2: Node, depth: int) -> float:
+        if depth < 1:
+            return 0
+
+        if node1.tag_name != node2.tag_name:
+            return 0
+
+        # compute nodes jaccard similarity
+        class_bits1 = self._get_class_bits(node1.classes)
+        class_bits2 = self._get_class_bits(node2.classes)
+        jaccard_top = bin(class_bits1 & class_bits2).count("1")
+        jaccard_bottom = bin(class_bits1 | class_bits2).count("1")
+        if jaccard_top == jaccard_bottom:
+            return 1  # also 0/0
+        jaccard = jaccard_top / jaccard_bottom
+
+        # add recursion
+        if node1.parent and node2.parent:
+            jaccard = 0.8 * jaccard + 0.2 * self(
+                node1.parent, node2.parent, depth=depth - 1
+            )
+        return jaccard
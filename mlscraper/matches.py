@@ -14,6 +14,7 @@ from mlscraper.html import get_similarity
 from mlscraper.html import HTMLAttributeMatch
 from mlscraper.html import HTMLExactTextMatch
 from mlscraper.html import Node
+from mlscraper.html import Page
 
 
 class Match:
@@ -54,7 +55,28 @@ class Match:
         """
         raise NotImplementedError()
 
-    def get_similarity_to(self, match: "Match"):
+    @property
+    def signature(self):
+        """
+        Structure of the match: extractors, tag paths and classes of matched nodes.
+
+        Matches with the same signature are likely to share a scraper.
+        """
+        raise NotImplementedError()
+
+    @property
+    def kind(self):
+        """
+        Extractors of the matched values, a coarse version of signature.
+
+        Matches of different kinds cannot share a scraper.
+        """
+        raise NotImplementedError()
+
+    def get_similarity_to(self, match: "Match", node_similarity=get_similarity):
+        """
+        Similarity of both matches, node_similarity compares two nodes.
+        """
         raise NotImplementedError()
 
 
@@ -73,7 +95,7 @@ class TextValueExtractor(Extractor):
     """
 
     def extract(self, node: Node):
-        return node.soup.text.strip()
+        return node.text.strip()
 
     def __repr__(self):
         return f"<{self.__class__.__name__}>"
@@ -99,8 +121,8 @@ class AttributeValueExtractor(Extractor):
         self.attr = attr
 
     def extract(self, node: Node):
-        if self.attr in node.soup.attrs:
-            return node.soup[self.attr]
+        if self.attr in node.html_attributes:
+            return node.html_attributes[self.attr]
 
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.attr=}>"
@@ -131,13 +153,23 @@ class DictMatch(Match):
             for m in self.match_by_key.values()
         )
 
-    def get_similarity_to(self, match: "Match"):
+    @cached_property
+    def signature(self):
+        return tuple((k, m.signature) for k, m in sorted(self.match_by_key.items()))
+
+    @cached_property
+    def kind(self):
+        return tuple((k, m.kind) for k, m in sorted(self.match_by_key.items()))
+
+    def get_similarity_to(self, match: "Match", node_similarity=get_similarity):
         assert isinstance(match, self.__class__)
         keys = set(self.match_by_key.keys()).intersection(
             set(match.match_by_key.keys())
         )
         return mean(
-            self.match_by_key[key].get_similarity_to(match.match_by_key[key])
+            self.match_by_key[key].get_similarity_to(
+                match.match_by_key[key], node_similarity
+            )
             for key in keys
         )
 
@@ -162,10 +194,19 @@ class ListMatch(Match):
     def span(self):
         return sum(get_relative_depth(m.root, self.root) + m.span for m in self.matches)
 
-    def get_similarity_to(self, match: "Match"):
+    @cached_property
+    def signature(self):
+        # independent of the number of items
+        return frozenset(m.signature for m in self.matches)
+
+    @cached_property
+    def kind(self):
+        return frozenset(m.kind for m in self.matches)
+
+    def get_similarity_to(self, match: "Match", node_similarity=get_similarity):
         assert isinstance(match, self.__class__)
         return mean(
-            lm1.get_similarity_to(lm2)
+            lm1.get_similarity_to(lm2, node_similarity)
             for lm1, lm2 in product(self.matches, match.matches)
         )
 
@@ -189,32 +230,105 @@ class ValueMatch(Match):
     def span(self):
         return 0
 
-    def get_similarity_to(self, match: "Match"):
+    @cached_property
+    def signature(self):
+        tag_path = tuple(a.tag_name for a in reversed(self.node.ancestors))
+        return (
+            self.extractor,
+            tag_path + (self.node.tag_name,),
+            frozenset(self.node.classes),
+        )
+
+    @property
+    def kind(self):
+        # tags may differ, e.g. .title can select h1 on one page and h2 on another
+        return self.extractor
+
+    def get_similarity_to(self, match: "Match", node_similarity=get_similarity):
         assert isinstance(match, self.__class__)
 
         if self.extractor != match.extractor:
             return 0
 
-        return get_similarity(self.node, match.node)
+        return node_similarity(self.node, match.node)
+
+
+class ValueMatchStore:
+    """
+    Value matches of a page, memoized by value.
+
+    Matches of a node and extractor are interned, so samples sharing a value,
+    e.g. "0" upvotes in several list items, get the same ValueMatch objects
+    and caches keyed by matches or their nodes are hit instead of missed.
+    """
+
+    def __init__(self, page: Page):
+        self.page = page
+        self._matches_by_value = {}
+        self._interned_matches = {}
+
+    def get_matches_by_value(
+        self, values: typing.Collection[str]
+    ) -> dict[str, list["ValueMatch"]]:
+        """
+        Get the value matches of all values, searching the page once for new ones.
+        """
+        new_values = [v for v in values if v not in self._matches_by_value]
+        if new_values:
+            for value, html_matches in self.page.find_all_many(new_values).items():
+                self._matches_by_value[value] = tuple(
+                    self._generate_value_matches(html_matches)
+                )
+        return {v: list(self._matches_by_value[v]) for v in values}
+
+    def _generate_value_matches(self, html_matches):
+        for html_match in html_matches:
+            if isinstance(html_match, HTMLExactTextMatch):
+                extractor = TextValueExtractor()
+            elif isinstance(html_match, HTMLAttributeMatch):
+                extractor = AttributeValueExtractor(html_match.attr)
+            else:
+                logging.warning(
+                    "Cannot deal with HTMLMatch type, ignoring "
+                    f"({html_match=}, {type(html_match)=}))"
+                )
+                continue
+
+            key = (html_match.node, extractor)
+            if key not in self._interned_matches:
+                self._interned_matches[key] = ValueMatch(html_match.node, extractor)
+            yield self._interned_matches[key]
+
+
+def get_value_match_store(page: Page) -> ValueMatchStore:
+    """
+    Get the shared ValueMatchStore of page.
+    """
+    # kept on the page object itself, so it is released along with the page
+    # and pages with equal html never share matches of each other's nodes
+    if page._value_match_store is None:
+        page._value_match_store = ValueMatchStore(page)
+    return page._value_match_store
 
 
 def generate_all_value_matches(
     node: Node, item: str
 ) -> typing.Generator[Match, None, None]:
     logging.info(f"generating all value matches ({node=}, {item=})")
-    for html_match in node.find_all(item):
-        matched_node = html_match.node
-        if isinstance(html_match, HTMLExactTextMatch):
-            extractor = TextValueExtractor()
-            yield ValueMatch(matched_node, extractor)
-        elif isinstance(html_match, HTMLAttributeMatch):
-            extractor = AttributeValueExtractor(html_match.attr)
-            yield ValueMatch(matched_node, extractor)
-        else:
-            logging.warning(
-                "Cannot deal with HTMLMatch type, ignoring "
-                f"({html_match=}, {type(html_match)=}))"
-            )
+    # the store covers the whole page, so only keep matches inside this node
+    for value_match in get_all_value_matches_by_item(node.page, [item])[item]:
+        if value_match.node == node or value_match.node.has_ancestor(node):
+            yield value_match
+
+
+def get_all_value_matches_by_item(
+    page: Page, items: typing.Collection[str]
+) -> dict[str, list[Match]]:
+    """
+    Find the value matches of all items at once.
+    """
+    logging.info(f"generating all value matches ({page=}, {len(items)=})")
+    return get_value_match_store(page).get_matches_by_value(items)
 
 
 def is_disjoint_match_combination(matches):
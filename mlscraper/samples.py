@@ -1,13 +1,14 @@
+import bisect
+import itertools
 import logging
 import typing
-from itertools import product
 
 from mlscraper.html import Page
 from mlscraper.matches import DictMatch
-from mlscraper.matches import generate_all_value_matches
+from mlscraper.matches import get_all_value_matches_by_item
 from mlscraper.matches import is_dimensions_match
-from mlscraper.matches import is_disjoint_match_combination
 from mlscraper.matches import ListMatch
+from mlscraper.matches import Match
 
 
 class ItemStructureException(Exception):
@@ -26,53 +27,158 @@ class Sample:
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.page=}, {self.value=}>"
 
-    def get_matches(self):
-        # todo: fix creating new sample objects, maybe by using Item class?
+    def get_matches(self) -> list[Match]:
+        return list(self.iter_matches())
+
+    def iter_matches(self) -> typing.Iterator[Match]:
+        """
+        Generate the matches of the sample lazily.
+        """
+        # search all values of the sample in one go
+        # instead of traversing the page for each value separately
+        matches_by_value = get_all_value_matches_by_item(
+            self.page, set(_iter_str_values(self.value))
+        )
+        return _iter_matches_for_value(self.page, self.value, matches_by_value)
+
+
+def _iter_str_values(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, list):
+        for v in value:
+            yield from _iter_str_values(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _iter_str_values(v)
+
+
+def _iter_matches_for_value(page: Page, value, matches_by_value: dict):
+    if isinstance(value, str):
+        # get all matches
+        value_matches = matches_by_value[value]
+
+        # filter out dimensions like width/height
+        value_matches = [vm for vm in value_matches if not is_dimensions_match(vm)]
+
+        # raise if not found
+        logging.info(f"found {len(value_matches)=} on page ({value=}, {page=})")
+        logging.info(f"{value_matches=}")
+        if not value_matches:
+            raise NoMatchFoundException(f"No match found on page ({page=}, {value=})")
+        return iter(value_matches)
+
+    if isinstance(value, list):
+        # nested matches are combined repeatedly, so they are kept in memory
+        matches_by_item = [
+            list(_iter_matches_for_value(page, v, matches_by_value)) for v in value
+        ]
+
+        return map(ListMatch, _iter_ordered_combinations(matches_by_item))
+
+    if isinstance(value, dict):
+        keys = list(value)
+        matches_by_key = [
+            list(_iter_matches_for_value(page, value[k], matches_by_value))
+            for k in keys
+        ]
+
+        return (
+            DictMatch(dict(zip(keys, mc)))
+            for mc in _iter_disjoint_combinations(matches_by_key)
+        )
+
+    raise RuntimeError(f"unsupported value: {value}")
+
+
+def _iter_ordered_combinations(
+    matches_per_item: list[list[Match]],
+) -> typing.Iterator[tuple[Match]]:
+    """
+    Generate combinations of one match per item in document order without overlap.
 
-        if isinstance(self.value, str):
-            # generate all matches
-            value_matches = list(generate_all_value_matches(self.page, self.value))
+    A selector returns nodes in document order, so only chains where each match
+    starts after the subtree of the previous one ends can be list items.
+    Matches that cannot be continued to a full chain are removed beforehand,
+    so no partial chain is a dead end.
+    """
+    if not matches_per_item:
+        yield ()
+        return
+
+    # keep matches that start before the last feasible match of the next item ends
+    feasible_per_item = [None] * len(matches_per_item)
+    last_start = None
+    for i in reversed(range(len(matches_per_item))):
+        feasible_per_item[i] = sorted(
+            (
+                m
+                for m in matches_per_item[i]
+                if last_start is None or m.root.end_position < last_start
+            ),
+            key=lambda m: m.root.position,
+        )
+        if not feasible_per_item[i]:
+            return
+        last_start = feasible_per_item[i][-1].root.position
+    starts_per_item = [[m.root.position for m in ms] for ms in feasible_per_item]
+
+    chain = []
+    # one iterator per item up to the next one to choose
+    iterators = [iter(feasible_per_item[0])]
+    while iterators:
+        match = next(iterators[-1], None)
+        if match is None:
+            iterators.pop()
+            if chain:
+                chain.pop()
+            continue
+
+        chain.append(match)
+        if len(chain) == len(matches_per_item):
+            yield tuple(chain)
+            chain.pop()
+        else:
+            # successors are the feasible matches after the subtree of match
+            i = len(chain)
+            start = bisect.bisect_right(starts_per_item[i], match.root.end_position)
+            iterators.append(itertools.islice(feasible_per_item[i], start, None))
 
-            # filter out dimensions like width/height
-            value_matches = [vm for vm in value_matches if not is_dimensions_match(vm)]
 
-            # raise if not found
-            logging.info(
-                f"found {len(value_matches)=} on page ({self.value=}, {self.page=})"
-            )
-            logging.info(f"{value_matches=}")
-            if not value_matches:
-                raise NoMatchFoundException(
-                    f"No match found on page ({self.page=}, {self.value=})"
-                )
-            return value_matches
-
-        if isinstance(self.value, list):
-            matches_by_value = [Sample(self.page, v).get_matches() for v in self.value]
-
-            # generate list of combinations
-            # todo filter combinations that use the same matches twice
-            # todo create combinations only in order
-            match_combis = product(*matches_by_value)
-
-            return [
-                ListMatch(tuple(match_combi))
-                for match_combi in match_combis
-                if is_disjoint_match_combination(match_combi)
-            ]
-
-        if isinstance(self.value, dict):
-            matches_by_key = {
-                k: Sample(self.page, self.value[k]).get_matches() for k in self.value
-            }
-
-            return [
-                DictMatch(dict(zip(matches_by_key.keys(), mc)))
-                for mc in product(*matches_by_key.values())
-                if is_disjoint_match_combination(mc)
-            ]
-
-        raise RuntimeError(f"unsupported value: {self.value}")
+def _iter_disjoint_combinations(
+    matches_per_position: list[list[Match]],
+) -> typing.Iterator[tuple[Match]]:
+    """
+    Generate combinations of one match per position without overlapping matches.
+
+    Same as filtering the product with is_disjoint_match_combination,
+    but a partial combination is dropped as soon as a match overlaps,
+    so work scales with the valid combinations instead of the full product.
+    """
+    if not matches_per_position:
+        yield ()
+        return
+
+    chosen = []
+    # one iterator per position up to the next one to choose
+    iterators = [iter(matches_per_position[0])]
+    while iterators:
+        for match in iterators[-1]:
+            if not any(match.has_overlap(c) for c in chosen):
+                break
+        else:
+            # no candidates left for this position, backtrack
+            iterators.pop()
+            if chosen:
+                chosen.pop()
+            continue
+
+        chosen.append(match)
+        if len(chosen) == len(matches_per_position):
+            yield tuple(chosen)
+            chosen.pop()
+        else:
+            iterators.append(iter(matches_per_position[len(chosen)]))
 
 
 class TrainingSet:
@@ -1,17 +1,40 @@
 import functools
+import heapq
+import itertools
 import logging
+import operator
 import re
+import time
 import typing
+from collections import defaultdict
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
+from mlscraper.html import Backend
 from mlscraper.html import make_selector_for_classes
 from mlscraper.html import Node
 from mlscraper.html import Page
+from mlscraper.html import parse_parallel_page
+from mlscraper.html import SelectorIndex
 from mlscraper.util import no_duplicates_generator_decorator
-from more_itertools import powerset
+from mlscraper.util import powerset_max_length
+from more_itertools import chunked
+from more_itertools import peekable
 
 # ids are used with #id, classes are used, too and rel is too generic
 ATTRIBUTE_SELECTOR_BLACKLIST = ("id", "class", "rel")
 
+# number of results after which selectivity is estimated as 0
+SELECTIVITY_SEARCH_LIMIT = 10
+
+# relative difference of selection times that counts as a tie
+SELECTION_TIME_TOLERANCE = 0.2
+
+# utility class frameworks put dozens of classes on a node, never try all subsets
+MAX_CLASS_COMBINATION_LENGTH = 3
+# and only combine the rarest classes, common ones hardly discriminate
+MAX_CLASSES_PER_NODE = 8
+
 
 class Selector:
     """
@@ -38,8 +61,17 @@ class CssRuleSelector(Selector):
     def __init__(self, css_rule):
         self.css_rule = css_rule
 
+        # compiled once per kind of backend, as backends compile differently
+        self._compiled_rules = {}
+
+    def _get_compiled_rule(self, node: Node):
+        backend = node.page.backend
+        if type(backend) not in self._compiled_rules:
+            self._compiled_rules[type(backend)] = backend.compile(self.css_rule)
+        return self._compiled_rules[type(backend)]
+
     def select_one(self, node: Node):
-        selection = node.select(self.css_rule)
+        selection = node.select(self._get_compiled_rule(node), limit=1)
         if not selection:
             raise AssertionError(
                 f"css rule does not match any node ({self.css_rule=}, {node=})"
@@ -47,16 +79,221 @@ class CssRuleSelector(Selector):
         return selection[0]
 
     def select_all(self, node: Node):
-        return node.select(self.css_rule)
-
-    def uniquely_selects(self, root: Node, nodes: typing.Collection[Node]):
-        return _uniquely_selects(self.css_rule, root, tuple(nodes))
+        return node.select(self._get_compiled_rule(node))
+
+    def uniquely_selects(
+        self,
+        root: Node,
+        nodes: typing.Collection[Node],
+        cache: "SelectorCache" = None,
+    ):
+        if cache is None:
+            return _uniquely_selects(self._get_compiled_rule(root), root, tuple(nodes))
+        return cache.uniquely_selects(self.css_rule, root, tuple(nodes))
+
+    def __getstate__(self):
+        # compiled rules cannot be pickled with every backend
+        state = self.__dict__.copy()
+        state["_compiled_rules"] = {}
+        return state
 
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.css_rule=}>"
 
 
-@functools.lru_cache(10000)
+class SelectorCache:
+    """
+    Bounded caches for selector generation and uniqueness checks.
+
+    Keys contain nodes and thus keep their pages alive,
+    so use one cache per training run and drop it afterwards.
+    """
+
+    def __init__(
+        self,
+        max_size=10000,
+        evaluation_backend: Backend = None,
+        max_class_combination_length=MAX_CLASS_COMBINATION_LENGTH,
+        max_classes_per_node=MAX_CLASSES_PER_NODE,
+    ):
+        """
+        :param max_size: maximum number of results kept per cached function
+        :param evaluation_backend: backend to check rules bitsets do not support with,
+            e.g. LxmlBackend to use XPath instead of soupsieve for SoupBackend pages
+        :param max_class_combination_length: maximum number of classes combined
+            in a node selector, see get_class_combinations
+        :param max_classes_per_node: number of the rarest classes of a node
+            to combine, see get_class_combinations
+        """
+        self.max_size = max_size
+        self.evaluation_backend = evaluation_backend
+        self.max_class_combination_length = max_class_combination_length
+        self.max_classes_per_node = max_classes_per_node
+        self._results_by_name = {}
+
+    def _get(self, name: str, key: tuple, compute: typing.Callable):
+        # least recently used results are evicted first
+        results = self._results_by_name.setdefault(name, OrderedDict())
+        if key in results:
+            results.move_to_end(key)
+            return results[key]
+
+        result = compute()
+        results[key] = result
+        if len(results) > self.max_size:
+            results.popitem(last=False)
+        return result
+
+    def get_node_selectors(self, node: Node) -> tuple[str]:
+        return self._get(
+            "node_selectors", (node,), lambda: _get_node_selectors(node, self)
+        )
+
+    def get_class_combinations(self, node: Node) -> typing.Iterator[tuple[str]]:
+        """
+        Lazily generate combinations of the rarest classes of node.
+
+        Classes are ranked by the number of nodes having them on the page
+        and only the max_classes_per_node rarest ones are combined,
+        so common utility classes do not multiply the candidates.
+        Combinations have at most max_class_combination_length classes.
+        """
+        if not node.classes:
+            # no need to index the page
+            return iter(())
+
+        selector_index = self.get_selector_index(node.page)
+        classes = sorted(
+            node.classes,
+            key=lambda cl: (selector_index.get_frequency(("class", cl)), cl),
+        )[: self.max_classes_per_node]
+        class_combinations = powerset_max_length(
+            classes, self.max_class_combination_length
+        )
+        # skip the empty set
+        return itertools.islice(class_combinations, 1, None)
+
+    def get_path_selectors(self, node: Node, max_length: int) -> "PathSelectorSearch":
+        return self._get(
+            "path_selectors",
+            (node, max_length),
+            lambda: PathSelectorSearch(node, max_length, self),
+        )
+
+    def get_path_prefixes(self, node: Node) -> list[tuple[str, Node]]:
+        return self._get(
+            "path_prefixes", (node,), lambda: _get_path_prefixes(node, self)
+        )
+
+    def compile(self, backend: Backend, css_rule: str):
+        # keyed by type, every page has its own backend instance
+        return self._get(
+            "compiled_rules",
+            (type(backend), css_rule),
+            lambda: backend.compile(css_rule),
+        )
+
+    def get_selector_index(self, page: Page) -> SelectorIndex:
+        return self._get("selector_indexes", (page,), lambda: SelectorIndex(page))
+
+    def select_positions(self, page: Page, css_rule: str) -> list[int]:
+        """
+        Positions css_rule selects on page in document order.
+
+        Selects once per page, results are valid for any root on the page.
+        """
+        return self._get(
+            "selected_positions",
+            (page, css_rule),
+            lambda: self._select_positions(page, css_rule),
+        )
+
+    def _select_positions(self, page: Page, css_rule: str) -> list[int]:
+        selector_index = self.get_selector_index(page)
+        bits = selector_index.select(css_rule)
+        if bits is not None:
+            return list(selector_index.iter_positions(bits))
+
+        # not supported by bitsets, positions are the same on the parallel page
+        evaluation_page = self.get_evaluation_page(page)
+        if evaluation_page is not page:
+            try:
+                compiled_rule = self.compile(evaluation_page.backend, css_rule)
+            except ValueError:
+                logging.info(f"cannot evaluate in parallel, falling back {css_rule=}")
+                evaluation_page = page
+        if evaluation_page is page:
+            compiled_rule = self.compile(page.backend, css_rule)
+        return [n.position for n in evaluation_page.select(compiled_rule)]
+
+    def uniquely_selects(self, css_rule: str, root: Node, nodes: tuple[Node]) -> bool:
+        return self.uniquely_selects_all(css_rule, {root: nodes})
+
+    def uniquely_selects_all(
+        self, css_rule: str, nodes_per_root: dict[Node, typing.Sequence[Node]]
+    ) -> bool:
+        """
+        Check if css_rule selects exactly the given nodes from each root.
+
+        The rule is run once per page, not once per root.
+        """
+        roots_per_page = defaultdict(dict)
+        for root, nodes_of_root in nodes_per_root.items():
+            roots_per_page[root.page][root] = nodes_of_root
+
+        return all(
+            self.get_selector_index(page).selects_exactly(
+                self.select_positions(page, css_rule), nodes_per_root_of_page
+            )
+            for page, nodes_per_root_of_page in roots_per_page.items()
+        )
+
+    def get_evaluation_page(self, page: Page) -> Page:
+        """
+        Get the page to evaluate rules with that bitsets do not support.
+
+        This is page parsed with the evaluation backend if set, or page itself.
+        """
+        if self.evaluation_backend is None or isinstance(
+            page.backend, type(self.evaluation_backend)
+        ):
+            return page
+
+        def parse():
+            parallel_page = parse_parallel_page(page, self.evaluation_backend)
+            if parallel_page is None:
+                logging.info("trees of backends differ, no parallel evaluation")
+                return page
+            return parallel_page
+
+        return self._get("evaluation_pages", (page,), parse)
+
+    def get_count_bounds(
+        self, page: Page, css_rule: str
+    ) -> typing.Optional[tuple[int, int]]:
+        return self.get_selector_index(page).get_count_bounds(css_rule)
+
+    def estimated_selectivity(self, page: Page, css_rule: str) -> float:
+        if self.get_selector_index(page).select(css_rule) is None:
+            # avoid selecting all nodes for an estimate
+            return self._get(
+                "estimated_selectivity",
+                (page, css_rule),
+                lambda: _estimated_selectivity(
+                    self.get_evaluation_page(page), css_rule
+                ),
+            )
+
+        count = len(self.select_positions(page, css_rule))
+        return 1 - min(count, SELECTIVITY_SEARCH_LIMIT) / SELECTIVITY_SEARCH_LIMIT
+
+    def clear(self):
+        self._results_by_name.clear()
+
+    def __len__(self):
+        return sum(map(len, self._results_by_name.values()))
+
+
 def _uniquely_selects(css_rule, root, nodes):
     # limit +1
     # ensures mismatch if selection result starts with nodes
@@ -64,43 +301,238 @@ def _uniquely_selects(css_rule, root, nodes):
     # but decreases load with many results significantly
     limit = len(nodes) + 1
 
-    # directly using soups:
-    # - avoids creating nodes for all selects
-    # - increases caching effort
-    return root.soup.select(css_rule, limit=limit) == [n.soup for n in nodes]
+    # nodes are cached by the page, so comparing them is cheap
+    return root.select(css_rule, limit=limit) == list(nodes)
+
+
+class SelectorScreening:
+    """
+    Checks chunks of candidate selectors on all pages at once with a process pool.
+
+    Each worker parses the pages once and reports which candidates
+    are unique on the roots of one page, results are combined in candidate order.
+    Use as context manager to shut down the workers.
+    """
+
+    def __init__(self, pages: list[Page], processes: int = None, chunk_size=512):
+        """
+        :param pages: the pages roots will be on
+        :param processes: number of worker processes, number of cpus by default
+        :param chunk_size: number of candidates to check per task
+        """
+        self.chunk_size = chunk_size
+
+        # pages with equal html are equal, so one worker copy serves them all
+        unique_pages = list(dict.fromkeys(pages))
+        self._page_indexes = {page: i for i, page in enumerate(unique_pages)}
+        self._executor = ProcessPoolExecutor(
+            processes,
+            initializer=_init_screening_worker,
+            initargs=([(p.html, p.backend) for p in unique_pages],),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def can_screen(self, roots: typing.Iterable[Node]) -> bool:
+        return all(r.page in self._page_indexes for r in roots)
+
+    def screen(
+        self,
+        selectors: typing.Iterable[CssRuleSelector],
+        nodes_per_root: dict[Node, list[Node]],
+    ) -> typing.Generator[CssRuleSelector, None, None]:
+        """
+        Yield the selectors that uniquely select the nodes of all roots, in order.
+        """
+        # one task per page and chunk, roots and nodes are sent as positions
+        positions_per_page = defaultdict(list)
+        for root, nodes_of_root in nodes_per_root.items():
+            positions_per_page[self._page_indexes[root.page]].append(
+                (root.position, tuple(n.position for n in nodes_of_root))
+            )
+
+        for chunk in chunked(selectors, self.chunk_size):
+            css_rules = [s.css_rule for s in chunk]
+            futures = [
+                self._executor.submit(_screen_in_worker, i, positions, css_rules)
+                for i, positions in positions_per_page.items()
+            ]
+            passed = functools.reduce(operator.and_, (f.result() for f in futures))
+            yield from (s for i, s in enumerate(chunk) if passed >> i & 1)
+
 
-    # using select
-    # - creates nodes for every soup object
-    # - leverages caching
-    # return root.select(self.css_rule, limit=limit) == nodes
+# state of screening workers, set up by the pool's initializer
+_worker_pages = []
+_worker_selector_cache = None
+
+
+def _init_screening_worker(htmls_and_backends):
+    global _worker_pages, _worker_selector_cache
+    _worker_pages = [Page(html, backend) for html, backend in htmls_and_backends]
+    _worker_selector_cache = SelectorCache()
+
+
+def _screen_in_worker(page_index: int, positions: list, css_rules: list[str]) -> int:
+    # bit i is set if css_rules[i] is unique on all roots
+    page = _worker_pages[page_index]
+    nodes_per_root = {
+        page.get_node_at(root_position): tuple(map(page.get_node_at, node_positions))
+        for root_position, node_positions in positions
+    }
+    passed = 0
+    for i, css_rule in enumerate(css_rules):
+        if _worker_selector_cache.uniquely_selects_all(css_rule, nodes_per_root):
+            passed |= 1 << i
+    return passed
 
 
 def generate_unique_selectors_for_nodes(
-    nodes: list[Node], roots, complexity: int
+    nodes: list[Node],
+    roots,
+    complexity: int,
+    cache: SelectorCache = None,
+    screening: SelectorScreening = None,
 ) -> typing.Generator[Selector, None, None]:
     """
     generate a unique selector which only matches the given nodes.
+
+    :param cache: cache to share between calls, e.g. during training
+    :param screening: check candidates in parallel with this instead of one by one
     """
+    if cache is None:
+        cache = SelectorCache()
+
     if roots is None:
         logging.info("roots is None, using pages as roots")
         roots = [n.page for n in nodes]
 
     nodes_per_root = {r: [n for n in nodes if n.has_ancestor(r)] for r in set(roots)}
-    for selector in generate_selectors_for_nodes(nodes, roots, complexity):
+    selectors = _rank_selectors(
+        generate_selectors_for_nodes(nodes, roots, complexity, cache),
+        nodes_per_root,
+        cache,
+    )
+    if screening is not None and screening.can_screen(nodes_per_root):
+        yield from screening.screen(selectors, nodes_per_root)
+        return
+
+    for selector in selectors:
         logging.info(f"check if unique: {selector}")
-        if all(
-            selector.uniquely_selects(r, nodes_of_root)
-            for r, nodes_of_root in nodes_per_root.items()
-        ):
+        if cache.uniquely_selects_all(selector.css_rule, nodes_per_root):
             yield selector
         else:
             # not unique
             pass
 
 
+def choose_cheapest_selector(
+    selectors: typing.Iterable[Selector], roots, candidates: int, select_all=True
+) -> typing.Optional[Selector]:
+    """
+    Choose the selector that is fastest to scrape with among the first candidates.
+
+    Unique selectors are equivalent on the training data, but the shortest one
+    is not necessarily the fastest, e.g. with :nth-child instead of an #id.
+    Timings within SELECTION_TIME_TOLERANCE of the fastest count as a tie
+    and the earlier candidate wins, so results do not depend on timing noise.
+    Returns None if there are no selectors.
+
+    :param select_all: time select_all like ListScraper, else select_one
+        like ValueScraper
+    """
+    selectors = list(itertools.islice(selectors, candidates))
+    if len(selectors) <= 1:
+        return next(iter(selectors), None)
+
+    roots = list(dict.fromkeys(roots))
+    timings = {s: measure_selection_time(s, roots, select_all) for s in selectors}
+    logging.info(f"measured selectors ({timings=})")
+    fastest = min(timings.values())
+    return next(
+        s for s in selectors if timings[s] <= fastest * (1 + SELECTION_TIME_TOLERANCE)
+    )
+
+
+def measure_selection_time(
+    selector: Selector, roots, select_all=True, repeat=3
+) -> float:
+    """
+    Best time in seconds of selecting with selector from all roots.
+
+    :param select_all: time select_all, else select_one
+    """
+    select = selector.select_all if select_all else selector.select_one
+
+    # warm up, e.g. compile the rule
+    for root in roots:
+        select(root)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for root in roots:
+            select(root)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _rank_selectors(
+    selectors: typing.Iterable[CssRuleSelector],
+    nodes_per_root: dict[Node, list[Node]],
+    cache: SelectorCache,
+) -> typing.Generator[CssRuleSelector, None, None]:
+    """
+    Reorder selectors of the same length by their estimated number of matches
+    and drop the ones that cannot be unique according to the estimates.
+    """
+
+    def get_surplus(selector: CssRuleSelector) -> typing.Optional[float]:
+        # how many more nodes than needed it matches at most, None if it can't match
+        surplus = 0
+        for root, nodes_of_root in nodes_per_root.items():
+            bounds = cache.get_count_bounds(root.page, selector.css_rule)
+            if bounds is None:
+                # not supported by the index, estimate with a limited query instead
+                selectivity = cache.estimated_selectivity(root.page, selector.css_rule)
+                count = round((1 - selectivity) * SELECTIVITY_SEARCH_LIMIT)
+                if count < min(len(nodes_of_root), SELECTIVITY_SEARCH_LIMIT):
+                    # below the limit, the count is exact
+                    return None
+                surplus += count - min(len(nodes_of_root), count)
+                continue
+
+            # bounds are for the whole page, so upper bounds subtrees as well
+            lower, upper = bounds
+            too_many = isinstance(root, Page) and lower > len(nodes_of_root)
+            if upper < len(nodes_of_root) or too_many:
+                return None
+            surplus += upper - len(nodes_of_root)
+        return surplus
+
+    for _, selectors_of_length in itertools.groupby(
+        selectors, key=lambda s: len(s.css_rule)
+    ):
+        surpluses = [(get_surplus(s), s) for s in selectors_of_length]
+        logging.info(
+            "pruned %d selectors by estimates",
+            sum(surplus is None for surplus, _ in surpluses),
+        )
+        ranked = sorted(
+            (sp for sp in surpluses if sp[0] is not None), key=lambda sp: sp[0]
+        )
+        yield from (s for _, s in ranked)
+
+
 @no_duplicates_generator_decorator
 def generate_selectors_for_nodes(
-    nodes: list[Node], roots, complexity: int
+    nodes: list[Node], roots, complexity: int, cache: SelectorCache = None
 ) -> typing.Generator[CssRuleSelector, None, None]:
     """
     Generate a selector which matches the given nodes.
@@ -113,50 +545,66 @@ def generate_selectors_for_nodes(
     assert roots, "no roots given"
     assert len(nodes) == len(roots)
 
-    list_of_selector_sets = (set(_get_path_selectors(n, complexity)) for n in nodes)
-    common_selectors = set.intersection(*list_of_selector_sets)
-    yield from (CssRuleSelector(cs) for cs in _sorted_css_selectors(common_selectors))
-
+    if cache is None:
+        cache = SelectorCache()
 
-def _sorted_css_selectors(selectors: typing.Iterable[str]):
-    """
-    Sorts css selectors by their complexity.
-    """
-    return sorted(selectors, key=len)
+    # selectors of each node come shortest first,
+    # so common selectors are found length by length
+    # without generating longer selectors than needed
+    first_selectors, *other_selectors = (
+        peekable(iter(cache.get_path_selectors(n, complexity)))
+        for n in dict.fromkeys(nodes)
+    )
+    while first_selectors:
+        length = len(first_selectors.peek())
+        candidates = list(_take_length(first_selectors, length))
+        for selectors in other_selectors:
+            if not candidates:
+                break
+            of_length = set(_take_length(selectors, length))
+            candidates = [c for c in candidates if c in of_length]
+        yield from (CssRuleSelector(cs) for cs in candidates)
+
+
+def _take_length(selectors: peekable, length: int):
+    # skip shorter selectors, take selectors of the given length
+    while selectors and len(selectors.peek()) <= length:
+        selector = next(selectors)
+        if len(selector) == length:
+            yield selector
 
 
-@functools.cache
-def _get_node_selectors(node: Node):
+def _get_node_selectors(node: Node, cache: SelectorCache):
     """
     All selectors for that node (without a path).
     """
-    return tuple(set(_generate_node_selectors(node)))
+    return tuple(set(_generate_node_selectors(node, cache)))
 
 
-def _generate_node_selectors(node: Node):
+def _generate_node_selectors(node: Node, cache: SelectorCache):
     if node.tag_name in ["html", "body"] or isinstance(node, Page):
         return
 
     # we have to add pseudo-selectors after generating the regular ones
-    selectors = set(_generate_regular_node_selectors(node))
+    selectors = set(_generate_regular_node_selectors(node, cache))
     yield from selectors
 
-    # generate :nth-child
-    # todo this sometimes leads to non-existent selectors?!
+    # generate :nth-child and :nth-of-type from the sibling indexes of the page
     if node.parent:
         for css_selector in selectors:
             is_id = css_selector.startswith("#")
             if not is_id:
-                # find out which index this element has if you select
-                # add one to deal with 1-based indexing
-                nth = node.parent.select(css_selector).index(node) + 1
-                yield f"{css_selector}:nth-child({nth})"
+                yield f"{css_selector}:nth-child({node.child_index})"
             else:
                 # is an id, distinct enough
                 pass
 
+        # only differs if siblings with other tags come first
+        if node.type_index != node.child_index:
+            yield f"{node.tag_name}:nth-of-type({node.type_index})"
 
-def _generate_regular_node_selectors(node: Node):
+
+def _generate_regular_node_selectors(node: Node, cache: SelectorCache):
     """
     This generates all selectors for this specific node without ancestor selectors.
     """
@@ -169,21 +617,18 @@ def _generate_regular_node_selectors(node: Node):
         yield f"#{node.id}"
 
     # classes
-    for class_combination in powerset(node.classes):
-        if class_combination:
-            class_selector = make_selector_for_classes(class_combination)
-            yield class_selector
-            yield f"{node.tag_name}{class_selector}"
-        else:
-            # empty set
-            pass
+    for class_combination in cache.get_class_combinations(node):
+        class_selector = make_selector_for_classes(class_combination)
+        yield class_selector
+        yield f"{node.tag_name}{class_selector}"
 
     # attribute
     # todo this is actually a pseudo element and can be applied to all selectors
 
     def is_plain_attribute_value(v):
         """filters out attributes that are complex and yield errors"""
-        return re.match(r"[A-z \-]", v)
+        # quotes, backslashes and line breaks would need escaping in css strings
+        return re.match(r"[A-z \-]", v) and not re.search(r'["\\\r\n\f]', v)
 
     for attribute, value in node.html_attributes.items():
         if attribute not in ATTRIBUTE_SELECTOR_BLACKLIST:
@@ -193,37 +638,82 @@ def _generate_regular_node_selectors(node: Node):
                 yield f'{node.tag_name}[{attribute}="{value}"]'
 
 
-@functools.cache
-def _get_path_selectors(node: Node, max_length: int) -> tuple[str]:
-    return tuple(set(_generate_path_selectors(node, max_length)))
-
+class PathSelectorSearch:
+    """
+    Path selectors of a node, generated lazily from shortest to longest.
 
-def _generate_path_selectors(
-    node: Node, max_length: int
-) -> typing.Generator[str, None, None]:
-    def is_unique(css_sel: str):
-        return css_sel.startswith("#")
+    A path selector consists of up to max_length node selectors of the node
+    and its ancestors, joined by descendant or child combinators.
+    Found selectors are kept, so iterating again replays them before searching on.
+    """
 
-    if max_length < 1:
-        return
+    def __init__(self, node: Node, max_length: int, cache: SelectorCache):
+        self._max_length = max_length
+        self._cache = cache
+        self._found = []
+        self._seen = set()
+
+        # entries are extensions of a base selector by the prefixes of its leftmost
+        # node, sorted like path selectors, and pushed one after another:
+        # (length, selector, tie breaker, base, prefixes, index, leftmost, parts)
+        self._heap = []
+        self._counter = itertools.count()
+        if max_length >= 1:
+            for node_selector in cache.get_node_selectors(node):
+                self._push(node_selector, None, None, None, node, 1)
+
+    def _push(self, selector: str, base, prefixes, index, leftmost: Node, parts: int):
+        entry = (len(selector), selector, next(self._counter))
+        heapq.heappush(self._heap, entry + (base, prefixes, index, leftmost, parts))
+
+    def _push_extension(self, base: str, prefixes: list, index: int, parts: int):
+        if index < len(prefixes):
+            prefix, ancestor = prefixes[index]
+            self._push(prefix + base, base, prefixes, index, ancestor, parts)
+
+    def _search_next(self) -> bool:
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            _, selector, _, base, prefixes, index, leftmost, parts = entry
+            if prefixes is not None:
+                # extensions are sorted, so the next one is the next shortest
+                self._push_extension(base, prefixes, index + 1, parts)
+
+            # ids are unique, no need to prepend ancestor selectors
+            if parts < self._max_length and not selector.startswith("#"):
+                # extensions are longer, so they are popped after this selector
+                prefixes = self._cache.get_path_prefixes(leftmost)
+                self._push_extension(selector, prefixes, 0, parts + 1)
+
+            # different ancestors can yield the same selector
+            if selector not in self._seen:
+                self._seen.add(selector)
+                self._found.append(selector)
+                return True
+        return False
+
+    def __iter__(self) -> typing.Generator[str, None, None]:
+        index = 0
+        while index < len(self._found) or self._search_next():
+            yield self._found[index]
+            index += 1
+
+
+def _get_path_prefixes(node: Node, cache: SelectorCache) -> list[tuple[str, Node]]:
+    """
+    Ancestor selectors with combinator to put in front of selectors of node.
 
-    # return node selectors themselves
-    yield from _get_node_selectors(node)
-
-    # return combined selectors
-    for node_selector in _get_node_selectors(node):
-        if not is_unique(node_selector):
-            for ancestor in node.ancestors:
-                for ancestor_selector in _get_path_selectors(ancestor, max_length - 1):
-                    yield f"{ancestor_selector} {node_selector}"
-                    if ancestor == node.parent:
-                        yield f"{ancestor_selector} > {node_selector}"
-        else:
-            # path is unique already, no need to append ancestor selectors
-            pass
+    Sorted like path selectors, i.e. by length first.
+    """
+    prefixes = []
+    for ancestor in node.ancestors:
+        for ancestor_selector in cache.get_node_selectors(ancestor):
+            prefixes.append((f"{ancestor_selector} ", ancestor))
+            if ancestor == node.parent:
+                prefixes.append((f"{ancestor_selector} > ", ancestor))
+    return sorted(prefixes, key=lambda p: (len(p[0]), p[0]))
 
 
-@functools.cache
 def _estimated_selectivity(page, selector) -> float:
     """
     This returns the estimated selectivity of the selector on the given page,
@@ -232,6 +722,5 @@ def _estimated_selectivity(page, selector) -> float:
     Regular selectors like "a" return something close to 0.
     """
     # selectivity: higher is better, 1 is unique
-    search_limit = 10
-    results = page.select(selector, limit=search_limit)
-    return 1 - (len(results) / search_limit)
+    results = page.select(selector, limit=SELECTIVITY_SEARCH_LIMIT)
+    return 1 - (len(results) / SELECTIVITY_SEARCH_LIMIT)
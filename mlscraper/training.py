@@ -1,17 +1,26 @@
+import heapq
 import logging
+from collections import defaultdict
 from itertools import combinations
-from itertools import product
+from itertools import count
+from math import prod
 from statistics import mean
 
+from mlscraper.html import Backend
+from mlscraper.html import NodeSimilarity
 from mlscraper.matches import DictMatch
 from mlscraper.matches import ListMatch
+from mlscraper.matches import Match
 from mlscraper.matches import ValueMatch
 from mlscraper.samples import TrainingSet
 from mlscraper.scrapers import DictScraper
 from mlscraper.scrapers import ListScraper
 from mlscraper.scrapers import ValueScraper
+from mlscraper.selectors import choose_cheapest_selector
 from mlscraper.selectors import generate_unique_selectors_for_nodes
 from mlscraper.selectors import PassThroughSelector
+from mlscraper.selectors import SelectorCache
+from mlscraper.selectors import SelectorScreening
 from more_itertools import first
 from more_itertools import flatten
 from more_itertools import unzip
@@ -33,58 +42,231 @@ def get_match_combination_priority(matches):
     return mean(m1.get_similarity_to(m2) for m1, m2 in combinations(matches, 2))
 
 
-def train_scraper(training_set: TrainingSet, complexity=100):
+class SimilarityMatrix:
+    """
+    Similarities between the matches of different samples.
+
+    Each pair of matches is compared once, no matter how many combinations
+    contain it, and node similarities are shared between all pairs.
+    """
+
+    def __init__(self, sample_matches: list[list[Match]]):
+        self.sample_matches = sample_matches
+        self._node_similarity = NodeSimilarity()
+
+        # filled sparsely, only compared pairs are stored
+        self._similarities = {}
+
+    def get_similarity(self, i: int, a: int, j: int, b: int) -> float:
+        """
+        Similarity of match a of sample i and match b of sample j (with i < j).
+        """
+        key = (i, a, j, b)
+        if key not in self._similarities:
+            match_a = self.sample_matches[i][a]
+            match_b = self.sample_matches[j][b]
+            self._similarities[key] = match_a.get_similarity_to(
+                match_b, self._node_similarity
+            )
+        return self._similarities[key]
+
+    def get_combination_priority(self, indices: tuple[int]) -> float:
+        """
+        Same as get_match_combination_priority for the matches at the given indices.
+        """
+        if len(indices) == 1:
+            return 1
+
+        return mean(
+            self.get_similarity(i, a, j, b)
+            for (i, a), (j, b) in combinations(enumerate(indices), 2)
+        )
+
+
+def iter_prioritized_index_combinations(
+    sample_matches: list[list[Match]],
+    similarity_matrix: SimilarityMatrix,
+    beam_width=10000,
+):
+    """
+    Lazily generate combinations of one match per sample (as indices), best first.
+
+    Only matches of one kind are combined, e.g. an attribute of a hidden meta tag
+    is never combined with a visible text.
+    Combinations of structurally equal matches come first, then the ones with
+    the most similar matches, like sorting all combinations would.
+    Combinations are built best-first one sample at a time, partial ones are
+    scored incrementally and optimistically assume similarity 1 for missing pairs,
+    so the product is never materialized.
+    Beyond beam_width partial combinations, the least promising ones are dropped.
+    """
+    sample_count = len(sample_matches)
+    pair_count = sample_count * (sample_count - 1) // 2
+    tie_breaker = count()
+
+    # (priority, depth, tie breaker, indices, similarity sum, same signature, bucket)
+    # negated for the min-heap, deeper entries first to finish ties depth-first
+    heap = []
+
+    def push(indices, similarity_sum, is_same_signature, bucket):
+        if pair_count:
+            missing_pair_count = pair_count - len(indices) * (len(indices) - 1) // 2
+            bound = (similarity_sum + missing_pair_count) / pair_count
+        else:
+            bound = 1
+        priority = (-is_same_signature, -bound)
+        entry = (priority, -len(indices), next(tie_breaker))
+        heapq.heappush(
+            heap, entry + (indices, similarity_sum, is_same_signature, bucket)
+        )
+
+    for bucket in _get_buckets(sample_matches):
+        push((), 0, True, bucket)
+
+    while heap:
+        *_, indices, similarity_sum, is_same_signature, bucket = heapq.heappop(heap)
+        if len(indices) == sample_count:
+            yield indices
+            continue
+
+        j = len(indices)
+        for b in bucket[j]:
+            signature = sample_matches[j][b].signature
+            push(
+                indices + (b,),
+                similarity_sum
+                + sum(
+                    similarity_matrix.get_similarity(i, a, j, b)
+                    for i, a in enumerate(indices)
+                ),
+                is_same_signature
+                and (
+                    not indices or signature == sample_matches[0][indices[0]].signature
+                ),
+                bucket,
+            )
+
+        if len(heap) > 2 * beam_width:
+            # a sorted list is a valid heap
+            heap = heapq.nsmallest(beam_width, heap)
+
+
+def _get_buckets(sample_matches: list[list[Match]]) -> list[list[list[int]]]:
+    # per kind shared by all samples, the indices of the matches of each sample
+    indices_by_kind = []
+    for matches in sample_matches:
+        indices_by_kind.append(defaultdict(list))
+        for a, match in enumerate(matches):
+            indices_by_kind[-1][match.kind].append(a)
+
+    if not indices_by_kind:
+        return []
+
+    # iterate the first sample's kinds to stay deterministic
+    shared_kinds = [
+        kind
+        for kind in indices_by_kind[0]
+        if all(kind in indices for indices in indices_by_kind[1:])
+    ]
+    return [[indices[kind] for indices in indices_by_kind] for kind in shared_kinds]
+
+
+def train_scraper(
+    training_set: TrainingSet,
+    complexity=100,
+    evaluation_backend: Backend = None,
+    processes: int = None,
+    selector_candidates: int = 1,
+):
     """
     Train a scraper able to extract the given training data.
+
+    :param evaluation_backend: backend to check selectors with during training,
+        e.g. LxmlBackend for speed, see SelectorCache
+    :param processes: check selectors on the pages with this many processes,
+        pays off with many training pages, see SelectorScreening
+    :param selector_candidates: find this many unique selectors per scraper
+        and keep the fastest one, see choose_cheapest_selector
     """
 
     logging.info(f"training {training_set=}")
 
+    all_sample_matches = [s.get_matches() for s in training_set.item.samples]
     logging.info(
         "number of matches found per sample: %s",
-        [(s, len(s.get_matches())) for s in training_set.item.samples],
+        [(s, len(ms)) for s, ms in zip(training_set.item.samples, all_sample_matches)],
     )
 
-    sample_matches = [
-        sorted(s.get_matches(), key=lambda m: m.span)[:100]
-        for s in training_set.item.samples
-    ]
-    match_combinations = list(product(*sample_matches))
-    logging.info(f"Trying {len(match_combinations)=}")
+    sample_matches = [sorted(ms, key=lambda m: m.span) for ms in all_sample_matches]
+    buckets = _get_buckets(sample_matches)
+    combination_count = sum(prod(map(len, bucket)) for bucket in buckets)
+    logging.info(f"Trying {combination_count=} in {len(buckets)} buckets")
 
-    # to train quicker, we'll start with combinations that have a high depth
+    # to train quicker, we'll start with combinations of structurally equal matches
+    # and then with combinations that have a high depth
     # this prefers matches, that have a deep root
     # and are thus closer to each other
-    match_combinations_prioritized = sorted(
-        match_combinations, key=get_match_combination_priority, reverse=True
+    # combinations are handled as indices into sample_matches
+    similarity_matrix = SimilarityMatrix(sample_matches)
+    index_combinations_prioritized = iter_prioritized_index_combinations(
+        sample_matches, similarity_matrix
     )
 
-    for match_combination in match_combinations_prioritized:
-        progress_ratio = match_combinations_prioritized.index(match_combination) / len(
-            match_combinations_prioritized
-        )
-        logging.info(f"progress {progress_ratio}")
-        try:
-            logging.info(f"trying to train scraper for matches ({match_combination=})")
-            roots = [s.page for s in training_set.item.samples]
-            scraper = train_scraper_for_matches(match_combination, roots, complexity)
-            return scraper
-        except NoScraperFoundException:
-            logging.exception(
-                "no scraper found "
-                "for complexity and match_combination "
-                f"({complexity=}, {match_combination=})"
+    # shared by all combinations, released once training is done
+    roots = [s.page for s in training_set.item.samples]
+    selector_cache = SelectorCache(evaluation_backend=evaluation_backend)
+    screening = SelectorScreening(roots, processes) if processes else None
+    try:
+        for attempt, indices in enumerate(index_combinations_prioritized):
+            match_combination = tuple(
+                sample_matches[i][a] for i, a in enumerate(indices)
             )
+            logging.info(f"progress {attempt / combination_count}")
+            try:
+                logging.info(
+                    f"trying to train scraper for matches ({match_combination=})"
+                )
+                scraper = train_scraper_for_matches(
+                    match_combination,
+                    roots,
+                    complexity,
+                    selector_cache,
+                    screening,
+                    selector_candidates,
+                )
+                return scraper
+            except NoScraperFoundException:
+                logging.exception(
+                    "no scraper found "
+                    "for complexity and match_combination "
+                    f"({complexity=}, {match_combination=})"
+                )
+    finally:
+        if screening:
+            screening.shutdown()
     raise NoScraperFoundException("did not find scraper")
 
 
-def train_scraper_for_matches(matches, roots, complexity: int):
+def train_scraper_for_matches(
+    matches,
+    roots,
+    complexity: int,
+    selector_cache: SelectorCache = None,
+    screening: SelectorScreening = None,
+    selector_candidates: int = 1,
+):
     """
     Train a scraper that finds the given matches from the given roots.
     :param matches: the matches to scrape
     :param roots: the root elements containing the matches, e.g. pages or elements on pages
     :param complexity: the complexity to try
+    :param selector_cache: cache for selector generation, one per training run
+    :param screening: process pool to check selectors with, see SelectorScreening
+    :param selector_candidates: number of unique selectors to choose the fastest from
     """
+    if selector_cache is None:
+        selector_cache = SelectorCache()
+
     found_types = set(map(type, matches))
     assert (
         len(found_types) == 1
@@ -122,11 +304,17 @@ def train_scraper_for_matches(matches, roots, complexity: int):
                 [(m.node, r, m.node == r) for m, r in zip(matches, roots)],
             )
 
-        selector = first(
+        selector = choose_cheapest_selector(
             generate_unique_selectors_for_nodes(
-                [m.node for m in matches], roots, complexity
+                [m.node for m in matches],
+                roots,
+                complexity,
+                selector_cache,
+                screening,
             ),
-            None,
+            roots,
+            selector_candidates,
+            select_all=False,
         )
         if not selector:
             logging.info(f"did not find selector for matches ({matches=})")
@@ -153,7 +341,14 @@ def train_scraper_for_matches(matches, roots, complexity: int):
             matches_per_key = [m.match_by_key[k] for m in matches]
             logging.info(f"matches for key: {matches_per_key=}")
             try:
-                scraper = train_scraper_for_matches(matches_per_key, roots, complexity)
+                scraper = train_scraper_for_matches(
+                    matches_per_key,
+                    roots,
+                    complexity,
+                    selector_cache,
+                    screening,
+                    selector_candidates,
+                )
             except NoScraperFoundException as e:
                 raise NoScraperFoundException(
                     f"Training DictScraper failed ({k=})"
@@ -181,11 +376,18 @@ def train_scraper_for_matches(matches, roots, complexity: int):
         # first selector is fine as it matches perfectly
         # no need to try other selectors
         # -> item_scraper would be the same
-        selector = first(
+        item_roots = list(item_roots)
+        selector = choose_cheapest_selector(
             generate_unique_selectors_for_nodes(
-                list(item_nodes), list(item_roots), complexity
+                list(item_nodes),
+                item_roots,
+                complexity,
+                selector_cache,
+                screening,
             ),
-            None,
+            item_roots,
+            selector_candidates,
+            select_all=True,
         )
         if selector:
             logging.info(f"selector that matches list items found ({selector=})")
@@ -200,7 +402,12 @@ def train_scraper_for_matches(matches, roots, complexity: int):
             )
             item_matches, item_roots = unzip(item_matches_and_item_roots)
             item_scraper = train_scraper_for_matches(
-                list(item_matches), list(item_roots), complexity
+                list(item_matches),
+                list(item_roots),
+                complexity,
+                selector_cache,
+                screening,
+                selector_candidates,
             )
             return ListScraper(selector, item_scraper)
         else:
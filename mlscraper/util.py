@@ -1,8 +1,17 @@
-from more_itertools import powerset
+from collections import deque
+from itertools import chain
+from itertools import combinations
 
 
 def powerset_max_length(candidates, length):
-    return filter(lambda s: len(s) <= length, powerset(candidates))
+    """
+    Subsets of candidates with up to length elements, like powerset, but lazily
+    and without enumerating the larger subsets.
+    """
+    candidates = list(candidates)
+    return chain.from_iterable(
+        combinations(candidates, r) for r in range(min(length, len(candidates)) + 1)
+    )
 
 
 def no_duplicates_generator_decorator(func):
@@ -14,3 +23,60 @@ def no_duplicates_generator_decorator(func):
                 seen.add(item)
 
     return inner
+
+
+class AhoCorasickAutomaton:
+    """
+    Multi-pattern string search, finds all patterns in a text in one pass.
+    """
+
+    def __init__(self, patterns):
+        # empty patterns would match everywhere
+        self.patterns = tuple(dict.fromkeys(p for p in patterns if p))
+
+        # trie with one dict of transitions per state, 0 is the root
+        self._transitions = [{}]
+        self._fail = [0]
+        self._outputs = [()]
+
+        for pattern in self.patterns:
+            state = 0
+            for char in pattern:
+                if char not in self._transitions[state]:
+                    self._transitions.append({})
+                    self._fail.append(0)
+                    self._outputs.append(())
+                    self._transitions[state][char] = len(self._transitions) - 1
+                state = self._transitions[state][char]
+            self._outputs[state] += (pattern,)
+
+        # breadth-first to compute failure links from shorter suffixes
+        queue = deque(self._transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._transitions[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._transitions[fail]:
+                    fail = self._fail[fail]
+                fail = self._transitions[fail].get(char, 0)
+                self._fail[next_state] = fail if fail != next_state else 0
+                self._outputs[next_state] += self._outputs[self._fail[next_state]]
+
+    def iter_matches(self, text: str):
+        """
+        Yield (end index, pattern) for each occurrence of a pattern in text.
+        """
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self._transitions[state]:
+                state = self._fail[state]
+            state = self._transitions[state].get(char, 0)
+            for pattern in self._outputs[state]:
+                yield i, pattern
+
+    def find_patterns(self, text: str) -> set:
+        """
+        Return all patterns that occur in text.
+        """
+        return {pattern for _, pattern in self.iter_matches(text)}
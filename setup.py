@@ -9,5 +9,10 @@ setup(
         "beautifulsoup4",
         "lxml",
         "more-itertools>=8",
+        "soupsieve",
     ],
+    extras_require={
+        # css support for LxmlBackend
+        "lxml": ["cssselect"],
+    },
 )
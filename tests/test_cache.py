@@ -0,0 +1,50 @@
+from mlscraper.cache import PageCache
+from mlscraper.html import Page
+from mlscraper.html import SoupBackend
+
+HTML = b'<html><body><div class="a"><p id="x">test</p><p>1</p></div></body></html>'
+
+
+def test_page_cache_in_memory():
+    cache = PageCache()
+    page1 = Page(HTML, cache=cache)
+    page2 = Page(HTML, cache=cache)
+    assert page1._tree is page2._tree
+    assert page1 == page2
+    assert page1.select("p") == page2.select("p")
+
+
+def test_page_cache_on_disk(tmp_path):
+    page = Page(HTML, cache=PageCache(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # new cache, so indexes are loaded from disk
+    cached_page = Page(HTML, cache=PageCache(tmp_path))
+    assert cached_page._tree is not page._tree
+    assert cached_page._tree.parents == page._tree.parents
+    assert cached_page.select("p")[0].id == "x"
+    assert cached_page.find_all("test")[0].node.id == "x"
+    assert cached_page.find_all("x")[0].node.tag_name == "p"
+
+
+def test_page_cache_different_html(tmp_path):
+    cache = PageCache(tmp_path)
+    page = Page(HTML, cache=cache)
+    other_page = Page(b"<html><body><p>test</p></body></html>", cache=cache)
+    assert page._tree is not other_page._tree
+    assert other_page.find_all("test")[0].node.id is None
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_page_cache_max_size():
+    cache = PageCache(max_size=1)
+    Page(HTML, cache=cache)
+    Page(b"<html></html>", cache=cache)
+    assert len(cache._entries) == 1
+
+
+def test_page_cache_corrupt_file(tmp_path):
+    cache = PageCache(tmp_path)
+    key = cache._get_key(HTML, SoupBackend())
+    (tmp_path / f"{key}.pickle").write_bytes(b"invalid")
+    assert Page(HTML, cache=cache).select("p")[0].id == "x"
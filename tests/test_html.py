@@ -2,7 +2,11 @@ import pytest
 from mlscraper.html import get_relative_depth
 from mlscraper.html import get_root_node
 from mlscraper.html import HTMLExactTextMatch
+from mlscraper.html import HTMLPartialAttributeMatch
+from mlscraper.html import HTMLPartialTextMatch
+from mlscraper.html import LxmlBackend
 from mlscraper.html import Page
+from mlscraper.html import SelectorIndex
 
 
 def test_get_root_nodes():
@@ -29,6 +33,29 @@ def test_node_ancestors():
     assert isinstance(ancestors[-1], Page), "last ancestor should be page"
 
 
+def test_node_has_ancestor():
+    html = b'<html><body><div><p id="one"></p></div><p id="two"></p></body></html>'
+    page = Page(html)
+    node_1 = page.select("#one")[0]
+    node_2 = page.select("#two")[0]
+    div = page.select("div")[0]
+    assert node_1.has_ancestor(div)
+    assert node_1.has_ancestor(page)
+    assert not node_2.has_ancestor(div)
+    assert not div.has_ancestor(div)
+    assert not div.has_ancestor(Page(b"<html><body><div></div></body></html>"))
+
+
+def test_get_root_node_nested():
+    html = b"<html><body><div><p><i>1</i><b>2</b></p><p>3</p></div></body></html>"
+    page = Page(html)
+    p, i, b = page.select("p")[0], page.select("i")[0], page.select("b")[0]
+    assert get_root_node([i, b]) == p
+    assert get_root_node([i, p]) == p
+    assert get_root_node([i, page.select("p")[1]]) == page.select("div")[0]
+    assert get_root_node([i]) == i
+
+
 def test_node_set():
     html = b"<html><body><p>test</p></body></html>"
     page = Page(html)
@@ -56,6 +83,44 @@ class TestPage:
             for html_match in page.find_all("karl")
         )
 
+    def test_find_all_with_special_characters(self):
+        html = b"<html><body><p>(+1) a.b &amp; c</p></body></html>"
+        page = Page(html)
+        html_matches = page.find_all("(+1) a.b & c")
+        assert [hm.node.tag_name for hm in html_matches] == ["p", "body", "html"]
+
+    def test_find_all_of_node(self):
+        html = (
+            b'<html><body><div><p>a</p><i>b</i></div><p title="a">a</p></body></html>'
+        )
+        page = Page(html)
+        div = page.select("div")[0]
+        assert len(page.find_all("a")) == 3
+        assert [hm.node for hm in div.find_all("a")] == div.select("p")
+
+    def test_find_all_many(self):
+        html = b'<html><body><p>a</p><p>b</p><a href="b">c</a></body></html>'
+        page = Page(html)
+        html_matches_by_item = page.find_all_many(["a", "b", "x"])
+        assert html_matches_by_item["a"] == page.find_all("a")
+        assert html_matches_by_item["b"] == page.find_all("b")
+        assert html_matches_by_item["x"] == []
+
+    def test_find_all_many_substring(self):
+        html = b'<html><body><p>karl lorey</p><a href="/lorey">x</a></body></html>'
+        page = Page(html)
+        html_matches = page.find_all_many(["lorey"], substring=True)["lorey"]
+        assert {type(hm) for hm in html_matches} == {
+            HTMLPartialTextMatch,
+            HTMLPartialAttributeMatch,
+        }
+
+    def test_find_all_many_with_nbsp(self):
+        html = "<html><body><p>123&nbsp;€</body></html>".encode()
+        page = Page(html)
+        html_matches_by_item = page.find_all_many(["123 €"], normalize_whitespace=True)
+        assert len(html_matches_by_item["123 €"]) > 0
+
     @pytest.mark.skip("no fuzzy matching yet")
     def test_find_all_with_nbsp(self):
         html = "<html><body><p>123&nbsp;€</body></html>".encode()
@@ -70,13 +135,40 @@ def test_equality():
     assert Page(same_html) is not Page(same_html)
 
 
+def test_node_identity():
+    # equal markup at different places must not result in equal nodes
+    html = b"<html><body><p>same</p><p>same</p></body></html>"
+    page = Page(html)
+    p_tag_nodes = page.select("p")
+    assert p_tag_nodes[0] != p_tag_nodes[1]
+    assert len(set(p_tag_nodes)) == 2
+    assert page.select("p")[0] is p_tag_nodes[0]
+
+
 def test_select():
     html = b"<html><body><p></p><p></p></body></html>"
     page = Page(html)
     p_tag_nodes = page.select("p")
     assert len(p_tag_nodes) == 2
-    # not used in practice
-    # assert len(set(p_tag_nodes)) == 2
+    assert len(set(p_tag_nodes)) == 2
+
+
+def test_nodes_are_lightweight():
+    html = b'<html><body><p class="a b">1</p><p class="a b">2</p></body></html>'
+    page = Page(html)
+    p1, p2 = page.select("p")
+    assert not hasattr(p1, "__dict__")
+    assert p1.classes == ("a", "b")
+    # class combinations are interned per page
+    assert p1.classes is p2.classes
+    assert p1.ancestors == [p1.parent] + p1.parent.ancestors
+
+
+def test_sibling_indexes():
+    page = Page(b"<html><body><div><span></span><p>1</p><span></span><p>2</p></div>")
+    assert [p.child_index for p in page.select("p")] == [2, 4]
+    assert [p.type_index for p in page.select("p")] == [1, 2]
+    assert page.select("div")[0].child_index == 1
 
 
 def test_tag_name():
@@ -103,6 +195,20 @@ def test_find_text_with_whitespace():
     assert all(isinstance(hm, HTMLExactTextMatch) for hm in html_matches)
 
 
+def test_find_text_in_ancestors():
+    html = (
+        b"<html><body><div> <p><b>x</b></p> <script>x</script></div>"
+        b"<div><p>x</p>y</div></body></html>"
+    )
+    page = Page(html)
+    html_matches = page.find_all("x")
+    divs = page.select("div")
+    # first div ignores the script, second div has additional text
+    assert divs[0] in [hm.node for hm in html_matches]
+    assert divs[1] not in [hm.node for hm in html_matches]
+    assert page._tree.text_lengths[divs[1]._position] == 2
+
+
 def test_get_relative_depth():
     html = b"<html><body><p>bla karl bla</p></body></html>"
     page = Page(html)
@@ -110,3 +216,124 @@ def test_get_relative_depth():
     assert get_relative_depth(p_tag, p_tag) == 0
     assert get_relative_depth(p_tag, p_tag.parent) == 1
     assert get_relative_depth(p_tag, p_tag.parent.parent) == 2
+    assert get_relative_depth(p_tag, page) == 3
+    assert p_tag.depth == 3
+
+
+class TestSelectorIndex:
+    html = b"""<html><body>
+    <div id="main" class="a b"><p class="a">1</p><span><p data-x="y">2</p></span></div>
+    <p class="a">3</p><p type="Text">4</p>
+    </body></html>"""
+
+    @pytest.mark.parametrize(
+        "css_rule",
+        [
+            "p",
+            ".a",
+            "p.a",
+            "#main",
+            "div p",
+            "div > p",
+            "body > div p",
+            "p[data-x]",
+            'p[data-x="y"]',
+            "p:nth-child(1)",
+            "span > p:nth-child(1)",
+            "p:nth-of-type(2)",
+            "div > p:nth-of-type(1)",
+            "body > p",
+            "html",
+            "table p",
+        ],
+    )
+    def test_same_as_select(self, css_rule):
+        page = Page(self.html)
+        index = SelectorIndex(page)
+        expected = index.get_bits(n._position for n in page.select(css_rule))
+        assert index.select(css_rule) == expected
+
+    @pytest.mark.parametrize("css_rule", ['p[type="text"]', "p:first-child", "p, a"])
+    def test_unsupported(self, css_rule):
+        assert SelectorIndex(Page(self.html)).select(css_rule) is None
+
+    def test_atom_bits_created_on_demand(self):
+        index = SelectorIndex(Page(self.html))
+        assert not index._bits_by_atom
+        assert index.get_frequency(("tag", "p")) == 4
+        assert not index._bits_by_atom
+        index.select("div > p")
+        assert set(index._bits_by_atom) == {("tag", "div"), ("tag", "p")}
+
+    def test_count_bounds(self):
+        index = SelectorIndex(Page(self.html))
+        assert index.get_count_bounds("p") == (4, 4)
+        assert index.get_count_bounds("p.a") == (0, 3)
+        assert index.get_count_bounds("div p") == (0, 4)
+        assert index.get_count_bounds("table") == (0, 0)
+        assert index.get_count_bounds("p:first-child") is None
+
+    def test_selects_exactly(self):
+        page = Page(self.html)
+        index = SelectorIndex(page)
+        div = page.select("div")[0]
+        positions = list(index.iter_positions(index.select("p")))
+        assert index.selects_exactly(positions, {div: div.select("p")})
+        assert not index.selects_exactly(positions, {div: div.select("p")[:1]})
+        assert not index.selects_exactly(positions, {div: div.select("p")[::-1]})
+        assert not index.selects_exactly(positions, {page: div.select("p")})
+        assert index.selects_exactly(
+            positions, {p: [] for p in page.select("p")}
+        ), "nothing selected below leaves"
+
+
+class TestLxmlBackend:
+    @pytest.fixture(autouse=True)
+    def require_cssselect(self):
+        pytest.importorskip("cssselect")
+
+    def test_select(self):
+        html = b'<html><body><div><p class="a b">1</p></div><p>2</p></body></html>'
+        page = Page(html, backend=LxmlBackend())
+        assert [n.text for n in page.select("p")] == ["1", "2"]
+        assert page.select("html")[0].parent == page
+
+        div = page.select("div")[0]
+        assert div.select("div") == []
+        assert div.select("body p") == [page.select("p.a")[0]]
+        assert div.select("p")[0].classes == ("a", "b")
+
+    def test_text(self):
+        html = (
+            b"<html><body><p>a<!-- c --><b>b</b><script>s</script>c</p></body></html>"
+        )
+        page = Page(html, backend=LxmlBackend())
+        assert page.select("p")[0].text == "abc"
+        assert page.select("script")[0].text == "s"
+
+    def test_same_tree_as_soup(self, stackoverflow_samples):
+        soup_page = stackoverflow_samples[0].page
+        lxml_page = Page(soup_page.html, backend=LxmlBackend())
+        assert len(soup_page.select("div")) == len(lxml_page.select("div"))
+        assert [hm.node._position for hm in soup_page.find_all("20")] == [
+            hm.node._position for hm in lxml_page.find_all("20")
+        ]
+
+    def test_multi_valued_attributes(self):
+        html = (
+            b'<html><body><a class="big red" rel="a b" title="a b">1</a></body></html>'
+        )
+        soup_page = Page(html)
+        lxml_page = Page(html, backend=LxmlBackend())
+        for page in [soup_page, lxml_page]:
+            assert page.find_all("big red") == []
+            assert page.select("a")[0].html_attributes == {
+                "class": ["big", "red"],
+                "rel": ["a", "b"],
+                "title": "a b",
+            }
+        assert [hm.attr for hm in lxml_page.find_all("a b")] == ["title"]
+
+    def test_empty(self):
+        page = Page("", backend=LxmlBackend())
+        assert page.select("p") == []
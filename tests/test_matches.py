@@ -1,8 +1,13 @@
+import gc
+import weakref
+
 from mlscraper.html import Page
 from mlscraper.matches import AttributeValueExtractor
 from mlscraper.matches import generate_all_value_matches
+from mlscraper.matches import get_all_value_matches_by_item
 from mlscraper.matches import is_dimensions_match
 from mlscraper.matches import ValueMatch
+from mlscraper.samples import Sample
 
 
 def test_is_dimensions_match_plain():
@@ -37,3 +42,32 @@ def test_extractor_equality():
     e2 = AttributeValueExtractor("href")
     assert e1 == e2
     assert len({e1, e2}) == 1
+
+
+def test_value_matches_are_shared():
+    page = Page(
+        b"<html><body><div><p>0</p><i>x</i></div><p>0</p><p>1</p></body></html>"
+    )
+    matches = get_all_value_matches_by_item(page, ["0", "1"])
+    assert get_all_value_matches_by_item(page, ["0"])["0"] == matches["0"]
+    assert all(
+        m1 is m2 for m1, m2 in zip(Sample(page, "0").get_matches(), matches["0"])
+    )
+
+    div = page.select("div")[0]
+    assert list(generate_all_value_matches(div, "0")) == matches["0"][:1]
+
+
+def test_value_matches_are_released_and_per_page():
+    html = b"<html><body><p>0</p></body></html>"
+    page = Page(html)
+    other_page = Page(html)
+    match = get_all_value_matches_by_item(page, ["0"])["0"][0]
+    other_match = get_all_value_matches_by_item(other_page, ["0"])["0"][0]
+    assert match.node.page is page
+    assert other_match.node.page is other_page
+
+    page_ref = weakref.ref(page)
+    del page, match
+    gc.collect()
+    assert page_ref() is None
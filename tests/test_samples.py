@@ -1,7 +1,12 @@
+from itertools import product
+
 import pytest
 from mlscraper.html import Page
 from mlscraper.matches import DictMatch
+from mlscraper.matches import is_disjoint_match_combination
 from mlscraper.matches import ListMatch
+from mlscraper.samples import _iter_disjoint_combinations
+from mlscraper.samples import _iter_ordered_combinations
 from mlscraper.samples import ItemStructureException
 from mlscraper.samples import make_training_set
 from mlscraper.samples import Sample
@@ -40,8 +45,8 @@ class TestMatch:
         sample = Sample(page, ["1", "2", "2", "4"])
         matches = sample.get_matches()
 
-        # todo check duplicate generation
-        # assert len(matches) == 2
+        # both 2s in document order only
+        assert len(matches) == 1
         assert all(isinstance(m, ListMatch) for m in matches)
 
     def test_get_matches_list_of_dicts(self):
@@ -67,3 +72,39 @@ class TestMatch:
         assert len(match.matches) == 2
         assert all(isinstance(m, DictMatch) for m in match.matches)
         print(match.root)
+
+    def test_iter_matches_is_lazy(self):
+        items = "".join("<li><p>a</p><p>b</p></li>" for _ in range(20))
+        page = Page(f"<html><body><ul>{items}</ul></body></html>")
+        sample = Sample(page, {"x": "a", "y": "b", "z": "a", "w": "b"})
+        match = next(sample.iter_matches())
+        assert isinstance(match, DictMatch)
+        assert is_disjoint_match_combination(list(match.match_by_key.values()))
+
+
+def test_iter_disjoint_combinations():
+    page = Page("<html><body><div><p>1</p><p>1</p></div><p>1</p></body></html>")
+    matches = Sample(page, "1").get_matches()
+    div_match = Sample(page, {"a": "1", "b": "1"}).get_matches()[0]
+    matches_per_position = [matches, matches + [div_match], matches]
+    assert list(_iter_disjoint_combinations(matches_per_position)) == [
+        mc for mc in product(*matches_per_position) if is_disjoint_match_combination(mc)
+    ]
+    assert list(_iter_disjoint_combinations([])) == [()]
+    assert list(_iter_disjoint_combinations([matches, []])) == []
+
+
+def test_iter_ordered_combinations():
+    page = Page("<html><body><div><p>1</p><p>1</p></div><p>1</p></body></html>")
+    matches = Sample(page, "1").get_matches()
+    div_match = Sample(page, {"a": "1", "b": "1"}).get_matches()[0]
+    matches_per_item = [matches + [div_match], matches, matches + [div_match]]
+    assert list(_iter_ordered_combinations(matches_per_item)) == [
+        mc
+        for mc in product(*matches_per_item)
+        if is_disjoint_match_combination(mc)
+        and all(m1.root.position < m2.root.position for m1, m2 in zip(mc, mc[1:]))
+    ]
+    assert len(list(_iter_ordered_combinations([matches] * 3))) == 1
+    assert list(_iter_ordered_combinations([matches] * 4)) == []
+    assert list(_iter_ordered_combinations([])) == [()]
@@ -1,3 +1,5 @@
+import pytest
+from mlscraper.html import LxmlBackend
 from mlscraper.html import Page
 from mlscraper.matches import AttributeValueExtractor
 from mlscraper.matches import TextValueExtractor
@@ -32,6 +34,41 @@ class TestListOfDictScraper:
         results = ls.get(sample.page)
         assert sample.value == results
 
+        # scraping with lxml yields the same results
+        pytest.importorskip("cssselect")
+        lxml_page = Page(sample.page.html, backend=LxmlBackend())
+        assert sample.value == ls.get(lxml_page)
+
+    def test_scrape_with_lxml_selects_once_per_rule(self, monkeypatch):
+        pytest.importorskip("cssselect")
+        rows = "".join(
+            f'<div class="row"><b class="name">n{i}</b><i class="v">{i}</i></div>'
+            for i in range(100)
+        )
+        page = Page(f"<html><body>{rows}</body></html>", backend=LxmlBackend())
+        scraper = ListScraper(
+            CssRuleSelector(".row"),
+            DictScraper(
+                {
+                    "name": ValueScraper(
+                        CssRuleSelector(".name"), TextValueExtractor()
+                    ),
+                    "v": ValueScraper(CssRuleSelector(".v"), TextValueExtractor()),
+                }
+            ),
+        )
+
+        calls = []
+        select = LxmlBackend.select
+        monkeypatch.setattr(
+            LxmlBackend, "select", lambda *args: calls.append(1) or select(*args)
+        )
+        results = scraper.get(page)
+        assert results == [{"name": f"n{i}", "v": str(i)} for i in range(100)]
+        assert results == scraper.get(Page(page.html))
+        # not once per item and key, which is quadratic for large lists
+        assert len(calls) == 3
+
 
 class TestDictScraper:
     def test_scrape_matches(self):
@@ -1,6 +1,16 @@
+import gc
+import pickle
+import weakref
+
+import pytest
+from mlscraper.html import LxmlBackend
 from mlscraper.html import Page
+from mlscraper.selectors import _rank_selectors
+from mlscraper.selectors import choose_cheapest_selector
 from mlscraper.selectors import CssRuleSelector
 from mlscraper.selectors import generate_unique_selectors_for_nodes
+from mlscraper.selectors import SelectorCache
+from mlscraper.selectors import SelectorScreening
 
 
 def _get_css_selectors_for_nodes(nodes):
@@ -72,3 +82,237 @@ class TestGenerateUniqueSelectorsForNodes:
 
         assert "div[itemprop]" in direct_css_selectors
         assert 'div[itemprop="user"]' in direct_css_selectors
+
+    def test_attribute_values_needing_escapes(self):
+        page = Page(
+            b'<html><body><p title="a\nb">1</p><p title=\'a"b\'>2</p></body></html>'
+        )
+        for node in page.select("p"):
+            selectors = _get_css_selectors_for_nodes([node])
+            assert selectors
+            assert not any("title=" in selector for selector in selectors)
+            assert all(page.select(selector) == [node] for selector in selectors)
+
+
+class TestSelectorCache:
+    def test_shared_between_calls(self):
+        page = Page(b'<html><body><p class="a">1</p><p>2</p></body></html>')
+        node = page.select("p.a")[0]
+        cache = SelectorCache()
+        selectors = list(generate_unique_selectors_for_nodes([node], None, 2, cache))
+        assert cache.get_path_selectors(node, 2) is cache.get_path_selectors(node, 2)
+        assert cache.uniquely_selects(".a", page, (node,))
+        assert not cache.uniquely_selects("p", page, (node,))
+        assert [s.css_rule for s in selectors] == [
+            s.css_rule for s in generate_unique_selectors_for_nodes([node], None, 2)
+        ]
+
+    def test_bounded(self):
+        page = Page(b"<html><body><p>1</p><p>2</p><p>3</p></body></html>")
+        cache = SelectorCache(max_size=2)
+        for node in page.select("p"):
+            cache.get_node_selectors(node)
+        assert len(cache) == 2
+
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_releases_pages(self):
+        page = Page(b'<html><body><p class="a">1</p></body></html>')
+        page_ref = weakref.ref(page)
+        node = page.select("p")[0]
+        list(generate_unique_selectors_for_nodes([node], None, 2))
+
+        del page, node
+        gc.collect()
+        assert page_ref() is None
+
+
+def test_css_rule_selector_compiles_once():
+    page = Page(b'<html><body><p class="a">1</p><p>2</p></body></html>')
+    selector = CssRuleSelector("p")
+    assert selector.select_one(page).text == "1"
+    assert len(selector.select_all(page)) == 2
+    assert len(selector._compiled_rules) == 1
+
+    # compiled rules are dropped when pickling
+    unpickled = pickle.loads(pickle.dumps(selector))
+    assert unpickled.css_rule == "p"
+    assert len(unpickled.select_all(page)) == 2
+
+
+def test_selector_cache_compiles_once():
+    page1 = Page(b"<html><body><p>1</p></body></html>")
+    page2 = Page(b"<html><body><p>2</p></body></html>")
+    cache = SelectorCache()
+    assert cache.compile(page1.backend, "p") is cache.compile(page2.backend, "p")
+    assert cache.uniquely_selects("p", page2, tuple(page2.select("p")))
+
+
+def test_selector_cache_falls_back_to_backend():
+    page = Page(b'<html><body><p class="a">1</p><p>2</p></body></html>')
+    cache = SelectorCache()
+    first_p = page.select("p")[0]
+    assert cache.uniquely_selects("p:first-child", page, (first_p,))
+    assert cache.uniquely_selects("p:nth-child(1)", page, (first_p,))
+    assert cache.get_selector_index(page).select("p:first-child") is None
+    # unescaped line breaks are invalid css, left to the backend to reject
+    assert cache.get_selector_index(page).select('p[title="a\nb"]') is None
+    assert cache.select_positions(page, "p:first-child") == [first_p.position]
+    assert cache.estimated_selectivity(page, "p") == 0.8
+    assert cache.estimated_selectivity(page, "p:first-child") == 0.9
+
+
+def test_selector_cache_uniquely_selects_all():
+    items = "".join(f'<li><a href="/{i}">{i}</a><p>{i}</p></li>' for i in range(100))
+    page = Page(f"<html><body><ul>{items}</ul></body></html>".encode())
+    nodes_per_root = {li: tuple(li.select("a")) for li in page.select("li")}
+    cache = SelectorCache()
+    assert cache.uniquely_selects_all("a", nodes_per_root)
+    assert not cache.uniquely_selects_all("p", nodes_per_root)
+    assert not cache.uniquely_selects_all("ul a", {page: nodes_per_root.popitem()[1]})
+    # one selection per rule and page, not per root
+    assert len(cache._results_by_name["selected_positions"]) == 3
+
+
+def test_path_selector_search():
+    page = Page(b'<html><body><div class="a"><p class="b">1</p></div></body></html>')
+    node = page.select("p")[0]
+    search = SelectorCache().get_path_selectors(node, 2)
+    selectors = list(search)
+    assert [len(s) for s in selectors] == sorted(len(s) for s in selectors)
+    assert {"p", ".b", "div p", "div > p", ".a .b"} <= set(selectors)
+    assert "div .a p" not in selectors, "too long"
+    assert list(search) == selectors, "replays found selectors"
+
+
+def test_path_selector_search_is_lazy():
+    page = Page(b"<html><body>" + b"<div>" * 50 + b"<p>1</p>" + b"</div>" * 50)
+    node = page.select("p")[0]
+    search = SelectorCache().get_path_selectors(node, 100)
+    assert next(iter(search)) == "p"
+    assert len(search._found) == 1
+
+
+def test_nth_selectors_use_sibling_position():
+    page = Page(b"<html><body><div><span>1</span><p>2</p><p>3</p></div></body></html>")
+    node = page.select("p")[0]
+    selectors = SelectorCache().get_node_selectors(node)
+    assert "p:nth-child(2)" in selectors
+    assert "p:nth-of-type(1)" in selectors
+    assert all(node in page.select(s) for s in selectors)
+
+
+def test_class_combinations_bounded_and_rarest_first():
+    utility_classes = " ".join(f"u{i}" for i in range(30))
+    page = Page(
+        f'<html><body><p class="{utility_classes}">1</p>'
+        f'<p class="{utility_classes} rare">2</p></body></html>'.encode()
+    )
+    node = page.select(".rare")[0]
+    cache = SelectorCache(max_class_combination_length=2, max_classes_per_node=5)
+    combinations = list(cache.get_class_combinations(node))
+    assert combinations[0] == ("rare",)
+    assert max(map(len, combinations)) == 2
+    assert len(combinations) == 5 + 5 * 4 // 2
+    assert ".rare.u0" in cache.get_node_selectors(node)
+    assert ".u2" not in cache.get_node_selectors(node), "common class dropped"
+
+
+def test_selector_cache_evaluates_with_parallel_lxml_page():
+    pytest.importorskip("cssselect")
+    page = Page(b'<html><body><p type="a">1</p><p type="b">2</p></body></html>')
+    cache = SelectorCache(evaluation_backend=LxmlBackend())
+    evaluation_page = cache.get_evaluation_page(page)
+    assert isinstance(evaluation_page.backend, LxmlBackend)
+
+    # not supported by bitsets
+    first_p = page.select("p")[0]
+    assert cache.uniquely_selects('p[type="a"]', page, (first_p,))
+    assert not cache.uniquely_selects('p[type="b"]', page, (first_p,))
+    assert cache.uniquely_selects("p:first-child", page, (first_p,))
+    assert cache.estimated_selectivity(page, "p:last-child") == 0.9
+
+
+def test_rank_selectors():
+    page = Page(
+        b'<html><body><p class="a">1</p><p class="b">2</p><p>3</p></body></html>'
+    )
+    node = page.select("p.b")[0]
+    selectors = [CssRuleSelector(r) for r in ("a", "p", ".b", "p.b", "div")]
+    ranked = _rank_selectors(selectors, {page: [node]}, SelectorCache())
+    # p matches too many nodes, a and div none, .b is shorter than p.b
+    assert [s.css_rule for s in ranked] == [".b", "p.b"]
+
+
+def test_rank_selectors_of_same_length():
+    page = Page(
+        b'<html><body><p class="bb">1</p><p class="bb cc">2</p>'
+        b'<p class="bb">3</p></body></html>'
+    )
+    body = page.select("body")[0]
+    node = page.select("p.cc")[0]
+    selectors = [CssRuleSelector(r) for r in (".bb", ".cc")]
+    ranked = _rank_selectors(selectors, {body: [node]}, SelectorCache())
+    assert [s.css_rule for s in ranked] == [".cc", ".bb"]
+
+
+def test_rank_selectors_estimates_unsupported_rules():
+    page = Page(
+        b'<html><body><p type="a">1</p><p type="b">2</p><p type="b">3</p></body></html>'
+    )
+    node = page.select("p")[0]
+    rules = ('p[type="b"]', 'p[type="a"]', 'p[type="c"]')
+    ranked = _rank_selectors(
+        [CssRuleSelector(r) for r in rules], {page: [node]}, SelectorCache()
+    )
+    # c selects nothing, a fewer nodes than b
+    assert [s.css_rule for s in ranked] == ['p[type="a"]', 'p[type="b"]']
+
+
+def test_selector_screening():
+    pages = [
+        Page(b'<html><body><p class="a">1</p><p>2</p></body></html>'),
+        Page(
+            b'<html><body><div><p class="a">3</p></div><p class="a">4</p></body></html>'
+        ),
+    ]
+    nodes = [pages[0].select("p")[0], pages[1].select("div p")[0]]
+    expected = list(generate_unique_selectors_for_nodes(nodes, None, 2))
+    with SelectorScreening(pages, processes=2, chunk_size=3) as screening:
+        screened = list(
+            generate_unique_selectors_for_nodes(nodes, None, 2, screening=screening)
+        )
+    assert [s.css_rule for s in screened] == [s.css_rule for s in expected]
+    assert "p:nth-child(1)" in [s.css_rule for s in screened]
+
+
+def test_choose_cheapest_selector():
+    page = Page(b'<html><body><div id="a"><p>1</p></div><p>2</p></body></html>')
+    node = page.select("#a p")[0]
+    selectors = list(generate_unique_selectors_for_nodes([node], [page], 3))
+    assert len(selectors) > 3
+
+    selector = choose_cheapest_selector(iter(selectors), [page, page], 3)
+    assert selector in selectors[:3]
+    assert choose_cheapest_selector(iter(selectors), [page], 1) == selectors[0]
+    assert choose_cheapest_selector(iter([]), [page], 3) is None
+
+
+def test_choose_cheapest_selector_times_the_scraper_method(monkeypatch):
+    page = Page(b"<html><body><p>1</p></body></html>")
+    selectors = [CssRuleSelector("p"), CssRuleSelector("body p")]
+    calls = []
+    monkeypatch.setattr(CssRuleSelector, "select_all", lambda s, n: calls.append(1))
+    choose_cheapest_selector(iter(selectors), [page], 2, select_all=False)
+    assert not calls, "value scrapers only select one node"
+
+    # near-ties are broken by candidate order, clear winners by timing
+    timings = {"p": 1.1, "body p": 1.0}
+    monkeypatch.setattr(
+        "mlscraper.selectors.measure_selection_time",
+        lambda s, roots, select_all: timings[s.css_rule],
+    )
+    assert choose_cheapest_selector(iter(selectors), [page], 2) is selectors[0]
+    timings["p"] = 2.0
+    assert choose_cheapest_selector(iter(selectors), [page], 2) is selectors[1]
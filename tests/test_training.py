@@ -1,3 +1,7 @@
+from itertools import product
+
+import pytest
+from mlscraper.html import LxmlBackend
 from mlscraper.html import Page
 from mlscraper.matches import TextValueExtractor
 from mlscraper.samples import Sample
@@ -6,9 +10,88 @@ from mlscraper.scrapers import ListScraper
 from mlscraper.scrapers import ValueScraper
 from mlscraper.selectors import CssRuleSelector
 from mlscraper.selectors import PassThroughSelector
+from mlscraper.training import get_match_combination_priority
+from mlscraper.training import iter_prioritized_index_combinations
+from mlscraper.training import SimilarityMatrix
 from mlscraper.training import train_scraper
 
 
+def test_similarity_matrix():
+    pages = [
+        Page(b'<html><body><p class="a">1</p><div class="a b"><p>1</p></div></body>'),
+        Page(b'<html><body><div class="b"><p class="a">1</p></div><i>1</i></body>'),
+        Page(b'<html><body><i class="c">1</i><p class="a">1</p></body>'),
+    ]
+    sample_matches = [Sample(page, "1").get_matches() for page in pages]
+    similarity_matrix = SimilarityMatrix(sample_matches)
+    assert not similarity_matrix._similarities, "filled on demand"
+    for indices in product(*(range(len(ms)) for ms in sample_matches)):
+        matches = [sample_matches[i][a] for i, a in enumerate(indices)]
+        assert similarity_matrix.get_combination_priority(
+            indices
+        ) == get_match_combination_priority(matches)
+
+
+def get_compatible_index_combinations(sample_matches):
+    # all combinations of matches of one kind, slow but obviously right
+    return [
+        indices
+        for indices in product(*(range(len(ms)) for ms in sample_matches))
+        if len({sample_matches[i][a].kind for i, a in enumerate(indices)}) == 1
+    ]
+
+
+def test_index_combinations_of_one_kind():
+    pages = [
+        Page(b'<html><head><meta content="1"></head><body><p>1</p></body></html>'),
+        Page(b'<html><body><p class="a">1</p><span>1</span><p>1</p></body></html>'),
+    ]
+    sample_matches = [Sample(page, "1").get_matches() for page in pages]
+    index_combinations = list(
+        iter_prioritized_index_combinations(
+            sample_matches, SimilarityMatrix(sample_matches)
+        )
+    )
+    # the meta attribute is excluded, texts of any tag are combined
+    assert sorted(index_combinations) == get_compatible_index_combinations(
+        sample_matches
+    )
+    for indices in index_combinations:
+        matches = [sample_matches[i][a] for i, a in enumerate(indices)]
+        assert all(isinstance(m.extractor, TextValueExtractor) for m in matches)
+    assert len({sample_matches[1][a].signature for _, a in index_combinations}) == 3
+
+
+def test_iter_prioritized_index_combinations():
+    pages = [
+        Page(b'<html><body><p class="a">1</p><div class="a b"><p>1</p></div></body>'),
+        Page(b'<html><body><div class="b"><p class="a">1</p></div><p>1</p></body>'),
+        Page(b'<html><body><p class="c">1</p><p class="a">1</p></body>'),
+    ]
+    sample_matches = [Sample(page, "1").get_matches() for page in pages]
+    similarity_matrix = SimilarityMatrix(sample_matches)
+
+    def get_priority(indices):
+        matches = [sample_matches[i][a] for i, a in enumerate(indices)]
+        return (
+            len({m.signature for m in matches}) == 1,
+            round(similarity_matrix.get_combination_priority(indices), 9),
+        )
+
+    expected = get_compatible_index_combinations(sample_matches)
+    index_combinations = list(
+        iter_prioritized_index_combinations(sample_matches, similarity_matrix)
+    )
+    assert sorted(index_combinations) == sorted(expected)
+    priorities = list(map(get_priority, index_combinations))
+    assert priorities == sorted(priorities, reverse=True)
+
+    # dropped partial combinations are never generated
+    assert len(
+        list(iter_prioritized_index_combinations(sample_matches, similarity_matrix, 1))
+    ) < len(expected)
+
+
 def test_train_scraper_simple_list():
     training_set = TrainingSet()
     page = Page(b"<html><body><p>a</p><i>noise</i><p>b</p><p>c</p></body></html>")
@@ -31,6 +114,16 @@ def test_train_scraper_simple_list():
     assert isinstance(item_scraper.extractor, TextValueExtractor)
 
 
+def test_train_scraper_with_evaluation_backend():
+    pytest.importorskip("cssselect")
+    training_set = TrainingSet()
+    page = Page(b"<html><body><p>a</p><i>noise</i><p>b</p><p>c</p></body></html>")
+    training_set.add_sample(Sample(page, ["a", "b", "c"]))
+    scraper = train_scraper(training_set, evaluation_backend=LxmlBackend())
+    assert scraper.selector.css_rule == "p"
+    assert scraper.get(page) == ["a", "b", "c"]
+
+
 def test_train_scraper_list_of_dicts():
     html = b"""
     <html>
@@ -49,6 +142,9 @@ def test_train_scraper_list_of_dicts():
     assert isinstance(scraper.selector, CssRuleSelector)
     assert scraper.selector.css_rule == "div"
 
+    cheapest_scraper = train_scraper(training_set, selector_candidates=3)
+    assert cheapest_scraper.get(page) == scraper.get(page)
+
     inner_scraper = scraper.scraper
     assert isinstance(inner_scraper, ListScraper)
     assert isinstance(inner_scraper.selector, CssRuleSelector)
@@ -80,6 +176,37 @@ def test_train_scraper_multipage():
         Page(b"""<html><body><ul><li>first</li><li>second</li></body></html>""")
     ) == ["first", "second"]
 
+    # same result when checking selectors in parallel
+    parallel_scraper = train_scraper(training_set, processes=2)
+    assert parallel_scraper.selector.css_rule == "li"
+
+
+def test_train_scraper_with_different_tags():
+    training_set = TrainingSet()
+    training_set.add_sample(
+        Sample(
+            Page(b'<html><body><h1 class="title">Foo</h1></body></html>'), {"t": "Foo"}
+        )
+    )
+    training_set.add_sample(
+        Sample(
+            Page(b'<html><body><h2 class="title">Bar</h2></body></html>'), {"t": "Bar"}
+        )
+    )
+    scraper = train_scraper(training_set)
+    assert scraper.get(
+        Page(b'<html><body><h3 class="title">Baz</h3></body></html>')
+    ) == {"t": "Baz"}
+
+
+def test_train_scraper_with_line_break_in_attribute():
+    html = b'<html><body><div><p title="a\nb">1</p></div><div><p title="c">2</p></div>'
+    page = Page(html)
+    training_set = TrainingSet()
+    training_set.add_sample(Sample(page, {"v": "1"}))
+    scraper = train_scraper(training_set)
+    assert scraper.get(page) == {"v": "1"}
+
 
 def test_train_scraper_stackoverflow(stackoverflow_samples):
     training_set = TrainingSet()
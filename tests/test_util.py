@@ -1,4 +1,6 @@
+from mlscraper.util import AhoCorasickAutomaton
 from mlscraper.util import no_duplicates_generator_decorator
+from mlscraper.util import powerset_max_length
 
 
 def test_no_duplicates_generator_decorator():
@@ -7,3 +9,27 @@ def test_no_duplicates_generator_decorator():
         yield from [1, 1, 2, 3, 3, 3]
 
     assert list(decorated_generator()) == [1, 2, 3]
+
+
+def test_aho_corasick_automaton():
+    automaton = AhoCorasickAutomaton(["he", "she", "his", "hers", ""])
+    assert list(automaton.iter_matches("ushers")) == [
+        (3, "she"),
+        (3, "he"),
+        (5, "hers"),
+    ]
+    assert automaton.find_patterns("ahishe") == {"his", "she", "he"}
+    assert automaton.find_patterns("") == set()
+
+
+def test_powerset_max_length():
+    assert list(powerset_max_length("abc", 2)) == [
+        (),
+        ("a",),
+        ("b",),
+        ("c",),
+        ("a", "b"),
+        ("a", "c"),
+        ("b", "c"),
+    ]
+    assert len(list(powerset_max_length(range(4), 10))) == 16